@@ -1,9 +1,14 @@
+import os
+import time
+_import_started = time.perf_counter()
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1") # Skip the banner print on import
 import pygame
+_pygame_import_seconds = time.perf_counter() - _import_started
 import socket
 import threading
 import json
 import sys
-import time
+from contextlib import contextmanager
 
 # --- Pygame Constants ---
 SQUARESIZE = 80
@@ -29,13 +34,89 @@ LIGHT_GREY = (200, 200, 200)
 # --- Custom Pygame Events for Network Messages ---
 SERVER_MESSAGE_EVENT = pygame.USEREVENT + 1
 
+# --- Reconnecting after a server restart ---
+RECONNECT_WINDOW = 20.0 # Seconds to keep trying; the server holds our seat longer than this
+RECONNECT_DELAY = 0.5
+RECONNECT_ATTEMPT_TIMEOUT = 2.0 # Per connect(); a host that drops packets would otherwise block for the OS TCP timeout
+
+# --- Fonts ---
+# A font file shipped next to the client is loaded directly; SysFont would scan every
+# installed font on each call. Without one we fall back to pygame's own bundled font.
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "font.ttf")
+_font_cache = {} # size -> pygame.font.Font, shared by every widget
+
+def get_font(size):
+    font = _font_cache.get(size)
+    if font is None:
+        font = _font_cache[size] = pygame.font.Font(FONT_PATH if os.path.exists(FONT_PATH) else None, size)
+    return font
+
+
+class StartupTimer:
+    # Times each startup phase and prints a single report once the first frame is shown
+    def __init__(self):
+        self.phases = [("import pygame", _pygame_import_seconds)]
+        self.reported = False
+
+    @contextmanager
+    def measure(self, name):
+        started = time.perf_counter()
+        try: yield
+        finally: self.phases.append((name, time.perf_counter() - started))
+
+    def report(self):
+        if self.reported: return
+        self.reported = True
+        total = sum(seconds for _name, seconds in self.phases)
+        print("Startup: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases) + f" (total {total * 1000:.0f}ms)")
+
+STARTUP = StartupTimer()
+
+
+def discover_local_ip():
+    # First try a route lookup: "connecting" a UDP socket sends no packet, it only asks the OS
+    # which interface would be used. That fails with ENETUNREACH when there is no route to the
+    # probe address (e.g. a LAN with no default gateway), so fall back to the local interfaces:
+    # the addresses of this host's own name, then (on Linux) each interface's own address.
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(("10.254.254.254", 1))
+        return probe.getsockname()[0]
+    except socket.error:
+        pass
+    finally:
+        probe.close()
+    for address in local_interface_addresses():
+        if not address.startswith("127."):
+            return address
+    return 'localhost'
+
+def local_interface_addresses():
+    try:
+        for _family, _type, _proto, _name, address in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            yield address[0]
+    except socket.error:
+        pass
+    if not sys.platform.startswith("linux"): return
+    import fcntl, struct # Linux only; Windows and macOS resolve their LAN address from the host name
+    query = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _index, name in socket.if_nameindex():
+            try: # SIOCGIFADDR: the interface's IPv4 address sits at bytes 20-24 of the returned ifreq
+                ifreq = fcntl.ioctl(query.fileno(), 0x8915, struct.pack('256s', name.encode()[:15]))
+            except OSError:
+                continue # Interface has no IPv4 address
+            yield socket.inet_ntoa(ifreq[20:24])
+    finally:
+        query.close()
+
 class Button:
     def __init__(self, x, y, width, height, text='Button', color=GREY, text_color=BLACK, font_size=30):
         self.rect = pygame.Rect(x, y, width, height)
         self.color = color
         self.text = text
         self.text_color = text_color
-        self.font = pygame.font.SysFont("monospace", font_size)
+        self.font = get_font(font_size)
         self.is_hovered = False
         self.visible = True # Added visibility flag
 
@@ -77,19 +158,29 @@ class Connect4ClientPygame:
         
         self.running_main_loop = True # For the main pygame loop
         self.running_networking = True # For the networking thread
+        self.send_lock = threading.Lock() # Main loop and networking thread (pong replies) both send
+        self.resume_token = None # From the server's welcome; reclaims our seat if the server restarts
 
         self.scores = {'X': 0, 'O': 0}
         self.my_score = 0
         self.opponent_score = 0
         self.rematch_requested_by_me = False
         self.rematch_info_message = ""
-
-        pygame.init()
-        pygame.font.init()
-        self.screen = pygame.display.set_mode(SIZE)
-        pygame.display.set_caption("Connect 4: The Rematch!")
-        self.font = pygame.font.SysFont("monospace", 25)
-        self.score_font = pygame.font.SysFont("monospace", 22)
+        self.clock = None # Latest clock snapshot from the server (None when the game is untimed)
+        self.clock_received_at = 0.0
+        self.turn_symbol = None
+        self.hint_column = None # Suggested column from the server's position analysis
+
+        # Only the modules we use; pygame.init() would also start audio, joystick etc.
+        with STARTUP.measure("display init"):
+            pygame.display.init()
+        with STARTUP.measure("open window"):
+            self.screen = pygame.display.set_mode(SIZE)
+            pygame.display.set_caption("Connect 4: The Rematch!")
+        with STARTUP.measure("load fonts"):
+            pygame.font.init()
+            self.font = get_font(25)
+            self.score_font = get_font(22)
 
         button_y = (ROW_COUNT + 1) * SQUARESIZE + (BOTTOM_MARGIN - 50) / 2 # Centered in bottom margin
         button_width = 180
@@ -111,6 +202,7 @@ class Connect4ClientPygame:
             self.connected = True
             print(f"Successfully connected to server.")
             self.status_message = "Connected. Waiting for game..."
+            self.send_json_to_server({"type": "hello"}) # Completes the server's handshake deadline
             
             self.network_thread = threading.Thread(target=self.receive_messages, daemon=True)
             self.network_thread.start()
@@ -122,26 +214,58 @@ class Connect4ClientPygame:
         if not self.connected: return
         try:
             message = json.dumps(data) + '\n'
-            self.client_socket.sendall(message.encode('utf-8'))
+            with self.send_lock:
+                self.client_socket.sendall(message.encode('utf-8'))
         except (socket.error, BrokenPipeError) as e:
             print(f"Error sending JSON: {e}.")
+            self.connected = False
+            if self.resume_token and self.running_networking:
+                self.status_message = "Connection lost. Reconnecting..."
+                try: self.client_socket.shutdown(socket.SHUT_RDWR) # Wakes the networking thread, which reconnects
+                except (socket.error, OSError): pass
+                return
             self.status_message = "Connection lost (send error)."
-            self.connected = False; self.game_over = True
+            self.game_over = True
             self.running_networking = False # Signal network thread to stop
 
+    def post_server_event(self, server_data):
+        pygame.event.post(pygame.event.Event(SERVER_MESSAGE_EVENT, {"server_data": server_data}))
+
+    def reconnect(self):
+        # Runs on the networking thread after the connection drops. A restarted server keeps
+        # our seat for a while, so keep dialling and present the resume token it gave us.
+        self.connected = False
+        self.post_server_event({"custom_type": "info", "payload": {"message": "Connection lost. Reconnecting..."}})
+        deadline = time.monotonic() + RECONNECT_WINDOW
+        while self.running_networking and time.monotonic() < deadline:
+            new_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            new_socket.settimeout(min(RECONNECT_ATTEMPT_TIMEOUT, max(0.1, deadline - time.monotonic())))
+            try:
+                new_socket.connect((self.server_ip, self.port))
+            except socket.error: # socket.timeout included
+                new_socket.close(); time.sleep(RECONNECT_DELAY); continue
+            new_socket.settimeout(None) # Back to blocking for receive_messages
+            try: self.client_socket.close()
+            except (socket.error, OSError): pass
+            self.client_socket = new_socket
+            self.connected = True
+            print("Reconnected to server. Reclaiming seat...")
+            self.send_json_to_server({"type": "hello", "payload": {"resume_token": self.resume_token}})
+            return self.connected
+        return False
+
 
     def receive_messages(self):
         buffer = ""
         while self.running_networking:
-            if not self.connected:
-                break 
             try:
-                # Set a timeout for recv so the loop can check running_networking more often
-                self.client_socket.settimeout(0.5) # Timeout of 0.5 seconds
+                # Blocking recv; cleanup_and_exit shuts the socket down to wake it
                 chunk = self.client_socket.recv(4096).decode('utf-8')
-                self.client_socket.settimeout(None) # Reset timeout for other operations if any
 
                 if not chunk: # Server closed connection gracefully
+                    if not self.running_networking: break # We shut the socket down ourselves
+                    if self.resume_token and self.reconnect():
+                        buffer = ""; continue
                     print("\nServer closed the connection.")
                     event_data = {"custom_type": "info", "payload": {"message": "Server disconnected."}}
                     pygame.event.post(pygame.event.Event(SERVER_MESSAGE_EVENT, {"server_data": event_data}))
@@ -153,15 +277,24 @@ class Connect4ClientPygame:
                     message_str, buffer = buffer.split('\n', 1)
                     try:
                         data_from_server = json.loads(message_str)
+                        msg_type = data_from_server.get("type")
+                        if msg_type == "ping": # Answer heartbeats here, without a GUI round trip
+                            self.send_json_to_server({"type": "pong", "payload": data_from_server.get("payload", {})})
+                            continue
+                        # Seat bookkeeping also lives here, since reconnecting happens on this thread
+                        if msg_type == "welcome" and data_from_server.get("payload", {}).get("resume_token"):
+                            self.resume_token = data_from_server["payload"]["resume_token"]
+                        elif msg_type == "error" and data_from_server.get("payload", {}).get("error_code") in ("SERVER_FULL", "RESTORING"):
+                            self.resume_token = None # No seat to come back to
                         pygame.event.post(pygame.event.Event(SERVER_MESSAGE_EVENT, {"server_data": data_from_server}))
                     except json.JSONDecodeError:
                         print(f"\n[Warning] Received invalid JSON: '{message_str[:100]}...'")
                         error_payload = {"custom_type": "internal_error", "payload": {"message": "Invalid JSON from server."}}
                         pygame.event.post(pygame.event.Event(SERVER_MESSAGE_EVENT, {"server_data": error_payload}))
             
-            except socket.timeout:
-                continue # Timeout allows checking self.running_networking; just continue loop
             except (socket.error, ConnectionResetError, BrokenPipeError) as e:
+                if self.running_networking and self.resume_token and self.reconnect():
+                    buffer = ""; continue
                 if self.running_networking: # Only report if we weren't already shutting down
                     print(f"\nConnection error in receive: {e}.")
                     event_data = {"custom_type": "info", "payload": {"message": "Connection error."}}
@@ -190,6 +323,10 @@ class Connect4ClientPygame:
         payload = actual_server_data.get("payload", {})
         
         print(f"GUI Handling: Type='{msg_type}', Payload='{payload}'")
+        if "clock" in payload:
+            self.clock = payload["clock"]
+            self.clock_received_at = time.monotonic()
+        if payload.get("turn"): self.turn_symbol = payload["turn"]
 
         if msg_type == "welcome":
             self.player_symbol = payload.get("symbol")
@@ -205,8 +342,9 @@ class Connect4ClientPygame:
              self.status_message = f"Client Error: {payload.get('message', 'Unknown internal error.')}"
         elif msg_type == "error":
             self.status_message = f"Err: {payload.get('message', 'Unknown')}"
-            if payload.get('error_code') == "SERVER_FULL": self.running_main_loop = False
+            if payload.get('error_code') in ("SERVER_FULL", "RESTORING"): self.running_main_loop = False
         elif msg_type == "game_start" or msg_type == "new_game":
+            self.hint_column = None
             self.status_message = payload.get("message", "Game starting!")
             self.parse_and_update_board_from_string(payload.get("board"))
             self.my_turn = (payload.get("turn") == self.player_symbol)
@@ -219,12 +357,14 @@ class Connect4ClientPygame:
                 self.my_score = self.scores.get(self.player_symbol, 0)
                 self.opponent_score = self.scores.get(self.opponent_symbol, 0)
         elif msg_type == "board_update":
+            self.hint_column = None
             self.parse_and_update_board_from_string(payload.get("board"))
             self.my_turn = (payload.get("turn") == self.player_symbol)
             if not self.game_over:
                  self.status_message = f"Your turn!" if self.my_turn else f"Player {payload.get('turn')}'s turn."
         elif msg_type == "your_turn":
             self.my_turn = True
+            self.turn_symbol = self.player_symbol
             if not self.game_over: self.status_message = payload.get("message", f"Your turn!")
         elif msg_type == "game_over":
             self.status_message = payload.get("message", "Game Over!")
@@ -236,6 +376,10 @@ class Connect4ClientPygame:
             self.scores = payload.get("scores", {'X':0, 'O':0})
             self.my_score = self.scores.get(self.player_symbol, 0)
             self.opponent_score = self.scores.get(self.opponent_symbol, 0)
+        elif msg_type == "position_analysis":
+            if self.my_turn and not self.game_over and payload.get("to_move") == self.player_symbol:
+                self.hint_column = payload.get("best_column")
+                if self.hint_column is not None: self.rematch_info_message = f"Hint: try column {self.hint_column}."
         elif msg_type == "rematch_info":
             self.rematch_info_message = payload.get("message", "")
         elif msg_type == "opponent_disconnected" or msg_type == "opponent_left_session":
@@ -260,6 +404,23 @@ class Connect4ClientPygame:
                 for c in range(COLUMN_COUNT):
                     self.board_array[r][c] = game_rows[r][c] if game_rows[r][c] in ['X', 'O'] else ' '
 
+    def format_clock_text(self):
+        # Counts the running player's time down locally between server updates
+        if not self.clock: return ""
+        elapsed = 0.0 if self.game_over else time.monotonic() - self.clock_received_at
+        def fmt(seconds):
+            seconds = max(0, int(seconds + 0.999))
+            return f"{seconds // 60}:{seconds % 60:02d}"
+        parts = []
+        for symbol in ('X', 'O'):
+            remaining = self.clock.get(symbol)
+            if remaining is None: continue
+            if symbol == self.turn_symbol: remaining -= elapsed
+            parts.append(f"{symbol} {fmt(remaining)}")
+        if self.clock.get("turn_time_left") is not None and not self.game_over:
+            parts.append(f"move {fmt(self.clock['turn_time_left'] - elapsed)}")
+        return "  ".join(parts)
+
     def draw_board_and_pieces(self):
         board_y_offset = TOP_MARGIN
         for c in range(COLUMN_COUNT):
@@ -273,12 +434,20 @@ class Connect4ClientPygame:
                                    (int(c * SQUARESIZE + SQUARESIZE / 2), 
                                     int(r * SQUARESIZE + SQUARESIZE / 2 + board_y_offset)), RADIUS)
 
+    def draw_hint_marker(self):
+        if self.hint_column is not None and self.my_turn and not self.game_over:
+            pygame.draw.circle(self.screen, WHITE, (self.hint_column * SQUARESIZE + SQUARESIZE // 2, TOP_MARGIN // 2), RADIUS, 3)
+
     def draw_dropping_piece_preview(self):
         if self.my_turn and not self.game_over and self.player_symbol and self.hover_column != -1:
             color = RED if self.player_symbol == 'X' else YELLOW
             pygame.draw.circle(self.screen, color, (self.hover_column * SQUARESIZE + SQUARESIZE // 2, TOP_MARGIN // 2), RADIUS)
 
     def run_game(self):
+        # Show the window before connecting so a slow or unreachable server doesn't look like a hang
+        with STARTUP.measure("first frame"):
+            self.draw_game_elements(); pygame.display.flip()
+        STARTUP.report()
         if not self.connect_to_server():
             self.draw_game_elements(); pygame.display.flip(); time.sleep(3)
             self.cleanup_and_exit()
@@ -302,6 +471,10 @@ class Connect4ClientPygame:
                     self.play_again_button.check_hover(mouse_pos)
                     self.quit_button.check_hover(mouse_pos)
 
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                    if self.my_turn and not self.game_over:
+                        self.send_json_to_server({"type": "analyze_position"})
+
                 if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                     if self.game_over:
                         if self.play_again_button.is_clicked(event):
@@ -320,6 +493,8 @@ class Connect4ClientPygame:
                             self.send_json_to_server({"type": "make_move", "payload": {"column": col}})
                             self.my_turn = False 
                             self.status_message = "Move sent..."
+                            self.hint_column = None
+                            if self.rematch_info_message.startswith("Hint:"): self.rematch_info_message = ""
             
             self.draw_game_elements()
             pygame.display.flip()
@@ -336,18 +511,19 @@ class Connect4ClientPygame:
                 self.send_json_to_server({"type": "quit_session"}) # Let server know
                 time.sleep(0.1) # Give it a moment to send
         
-        if hasattr(self, 'network_thread') and self.network_thread.is_alive():
-            print("Waiting for network thread to join...")
-            self.network_thread.join(timeout=1.0) # Short timeout
-
         if hasattr(self, 'client_socket'): # Check if socket exists
             try:
                 print("Shutting down client socket...")
-                self.client_socket.shutdown(socket.SHUT_RDWR)
+                self.client_socket.shutdown(socket.SHUT_RDWR) # Also wakes the networking thread's recv
             except (socket.error, OSError): pass 
-            finally:
-                try: self.client_socket.close()
-                except (socket.error, OSError): pass
+
+        if hasattr(self, 'network_thread') and self.network_thread.is_alive():
+            print("Waiting for network thread to join...")
+            self.network_thread.join(timeout=1.0) # Short timeout
+
+        if hasattr(self, 'client_socket'):
+            try: self.client_socket.close()
+            except (socket.error, OSError): pass
         
         self.connected = False
         print("Client has shut down.")
@@ -360,6 +536,7 @@ class Connect4ClientPygame:
         
         pygame.draw.rect(self.screen, BLACK, (0,0, WIDTH, TOP_MARGIN)) # Area for dropping piece
         self.draw_dropping_piece_preview()
+        self.draw_hint_marker()
 
         self.draw_board_and_pieces() # Draws board below the top margin
         
@@ -376,6 +553,13 @@ class Connect4ClientPygame:
             score_rect = score_surf.get_rect(centerx=WIDTH/2, top=y_offset)
             self.screen.blit(score_surf, score_rect)
             y_offset += score_surf.get_height() + 5
+
+        clock_text = self.format_clock_text()
+        if clock_text:
+            clock_surf = self.score_font.render(clock_text, True, WHITE, BLACK)
+            clock_rect = clock_surf.get_rect(centerx=WIDTH/2, top=y_offset)
+            self.screen.blit(clock_surf, clock_rect)
+            y_offset += clock_surf.get_height() + 5
         
         if self.rematch_info_message:
             rematch_msg_surf = self.score_font.render(self.rematch_info_message, True, LIGHT_GREY, BLACK) # Added background
@@ -388,12 +572,8 @@ class Connect4ClientPygame:
 
 
 if __name__ == "__main__":
-    default_ip = 'localhost'
-    try:
-        temp_s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); temp_s.connect(("8.8.8.8", 80))
-        local_ip_suggestion = temp_s.getsockname()[0]; temp_s.close()
-        default_ip = local_ip_suggestion
-    except socket.error: pass
+    with STARTUP.measure("local IP lookup"):
+        default_ip = discover_local_ip()
 
     server_ip = input(f"Enter Server IP (e.g., {default_ip}): ").strip() or default_ip
     
@@ -0,0 +1,176 @@
+import gc
+import inspect
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from connect4_server_lan import (Connect4Game, Connect4Server, ConnectionRecord, ConnectionSet, GameClock, TimerWheel,
+                                 TokenBucket, ZOBRIST_SIDE)
+
+# Measures how many bytes the server holds per idle connection and per active game, at a scale
+# (10k by default) where per-object overhead dominates. Usage: python connect4_memory_benchmark.py [count]
+# The heap table only covers the per-connection records: sockets are stood in for by plain objects and no
+# handler threads are started. The cost of those is measured separately as resident memory (RSS), with
+# real threads blocked in recv on socket pairs, at the server's stack size and at the platform default.
+
+OPENING = [3, 3, 2, 4, 4, 2, 5, 1, 1, 6] # Ten plies, enough for a mid-game board
+THREADS = 1000 # Idle handler threads started per stack size; each also holds two file descriptors
+
+
+def no_op(*args): pass
+
+
+def bytes_per_item(build, count):
+    # Traced heap growth while `build` creates `count` items, divided by `count`
+    keys = [object() for _ in range(count)]
+    kept = [None] * count # Preallocated so the holding list is not counted
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    build(keys, kept)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def compact_connections(keys, kept):
+    # The layout the server uses now: ConnectionSet + dict of ConnectionRecord
+    wheel, clients, client_data = TimerWheel(), ConnectionSet(), {}
+    for i, sock in enumerate(keys):
+        clients.add(sock)
+        record = ConnectionRecord("X", ip="10.0.0.1", resume_token="0123456789abcdef")
+        record.handshake_timer = wheel.schedule(5.0, no_op, sock)
+        record.heartbeat_timer = wheel.schedule(5.0, no_op, sock)
+        record.idle_timer = wheel.schedule(15.0, no_op, sock)
+        client_data[sock] = record
+        kept[i] = TokenBucket(10.0, 20) # The handler thread's own message bucket
+    kept.append((wheel, clients, client_data))
+
+
+def legacy_connections(keys, kept):
+    # The previous layout: a list of sockets, a dict of dicts and a socket -> thread dict
+    wheel, clients, client_data, client_threads = TimerWheel(), [], {}, {}
+    for i, sock in enumerate(keys):
+        clients.append(sock)
+        client_data[sock] = {
+            "symbol": "X", "rematch_requested": False, "opponent_socket": None, "ip": "10.0.0.1",
+            "resume_token": "0123456789abcdef", "last_seen": 0.0, "ping_seq": 0,
+            "timers": {
+                "handshake": wheel.schedule(5.0, no_op, sock),
+                "heartbeat": wheel.schedule(5.0, no_op, sock),
+                "idle": wheel.schedule(15.0, no_op, sock),
+            },
+        }
+        client_threads[sock] = None # The Thread object itself is counted in the resident memory section
+        kept[i] = TokenBucket(10.0, 20)
+    kept.append((wheel, clients, client_data, client_threads))
+
+
+def compact_rooms(keys, kept):
+    for i in range(len(keys)):
+        game = Connect4Game()
+        for col in OPENING:
+            game.make_move(col)
+            game.switch_player()
+        kept[i] = (game, GameClock(base_time=300.0, increment=2.0, move_time=60.0))
+
+
+def legacy_rooms(keys, kept):
+    # Connect4Game and GameClock as they were: instance dicts, and a board of six lists of str
+    for i in range(len(keys)):
+        board = [[' ' for _ in range(7)] for _ in range(6)]
+        symbol = "X"
+        for col in OPENING:
+            row = max(r for r in range(6) if board[r][col] == ' ')
+            board[row][col] = symbol
+            symbol = "O" if symbol == "X" else "X"
+        game = SimpleNamespace(board=board, current_player_symbol=symbol, game_over=False, winner=None,
+                               is_draw=False, zobrist_hash=ZOBRIST_SIDE[symbol] ^ 1, mirror_hash=ZOBRIST_SIDE[symbol] ^ 2)
+        clock = SimpleNamespace(base_time=300.0, increment=2.0, move_time=60.0, remaining={'X': 300.0, 'O': 300.0},
+                                running_symbol=None, turn_started=None)
+        kept[i] = (game, clock)
+
+
+def resident_bytes():
+    # Resident set size of this process, or None where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def idle_handler(sock, started):
+    started.release()
+    sock.recv(1024) # Blocked here like an idle handle_client, until the other end closes
+
+
+def resident_per_thread(count, stack_size):
+    # RSS growth per thread blocked in recv on its own socket pair: the Thread object, its frames, both
+    # socket objects and the stack pages it has touched. A stack_size of 0 keeps the platform default.
+    pairs, threads, started = [], [], threading.Semaphore(0)
+    gc.collect()
+    before = resident_bytes()
+    previous = threading.stack_size(stack_size)
+    try:
+        for _ in range(count):
+            ours, theirs = socket.socketpair()
+            pairs.append((ours, theirs))
+            thread = threading.Thread(target=idle_handler, args=(ours, started), daemon=True)
+            thread.start()
+            threads.append(thread)
+    finally:
+        threading.stack_size(previous)
+    for _ in threads: started.acquire()
+    time.sleep(0.2) # Lets the last threads get from release() into recv
+    after = resident_bytes()
+    for ours, theirs in pairs: theirs.close()
+    for thread in threads: thread.join()
+    for ours, theirs in pairs: ours.close()
+    return (after - before) / count
+
+
+def print_row(label, now, before):
+    print(f"{label:<28}{now:>10.0f} B{before:>12.0f} B{100 * (before - now) / before:>9.0f}%")
+
+
+def report(label, build_now, build_before, count):
+    now = bytes_per_item(build_now, count)
+    before = bytes_per_item(build_before, count)
+    print_row(label, now, before)
+    return now, before
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"Python heap per item (records only, no threads or sockets), averaged over {count} items")
+    print(f"{'':<28}{'now':>12}{'before':>14}{'saved':>10}")
+    heap_now, heap_before = report("Idle connection", compact_connections, legacy_connections, count)
+    report("Active room (game + clock)", compact_rooms, legacy_rooms, count)
+    # Thread stacks are reserved outside the Python heap, so tracemalloc cannot see them.
+    # Only the pages a thread actually touches become resident.
+    stack_size = inspect.signature(Connect4Server.__init__).parameters["thread_stack_size"].default
+    threads = min(count, THREADS)
+    try:
+        import resource
+        soft_limit = resource.getrlimit(resource.RLIMIT_STACK)[0] # pthreads default to this on Linux
+        platform_kb = f"{soft_limit // 1024} KB" if soft_limit > 0 else "the platform default"
+        fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if fd_limit > 0: threads = max(1, min(threads, (fd_limit - 64) // 2)) # Two descriptors per socket pair
+    except (ImportError, ValueError):
+        platform_kb = "the platform default"
+    print(f"Handler thread stack (virtual, per connection): {stack_size // 1024} KB, down from {platform_kb}")
+    if resident_bytes() is None:
+        print("Resident memory per handler thread: skipped, needs /proc/self/statm")
+    else:
+        resident_per_thread(threads, stack_size) # Discarded: the first run also pays for growing the allocator's pools
+        thread_now = resident_per_thread(threads, stack_size)
+        thread_before = resident_per_thread(threads, 0)
+        print(f"\nResident memory (RSS) per connection, averaged over {threads} threads blocked in recv")
+        print(f"{'':<28}{'now':>12}{'before':>14}{'saved':>10}")
+        print_row("Handler thread + sockets", thread_now, thread_before)
+        print_row("Idle connection, total", heap_now + thread_now, heap_before + thread_before)
@@ -2,19 +2,68 @@ import socket
 import threading
 import json
 import time
+import heapq
+import itertools
+import os
+import random
+import re
+import secrets
+import select
+import signal
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter, OrderedDict
 
-# Connect4Game class remains the same as the last version I provided
+# Zobrist keys: one random 64-bit value per (symbol, row, col) plus one per side to move.
+# Fixed seed so hashes are stable across restarts (the position index is saved to disk).
+_zobrist_rng = random.Random(0xC0442)
+ZOBRIST_PIECES = {symbol: [[_zobrist_rng.getrandbits(64) for _ in range(7)] for _ in range(6)] for symbol in ('X', 'O')}
+ZOBRIST_SIDE = {'X': _zobrist_rng.getrandbits(64), 'O': _zobrist_rng.getrandbits(64)}
+
+# Passing the listening socket to a new server process needs Unix sockets with SCM_RIGHTS
+HANDOFF_SUPPORTED = hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds")
+
+
+def write_file_atomically(path, data):
+    # Unique temp name in the same directory, so concurrent writers never share a temp file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f: f.write(data)
+        os.replace(tmp_path, path) # Atomic, so a crash mid-write never leaves a torn file
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+
+EMPTY_CELL = ord(' ') # Value of an empty square in Connect4Game.cells
+
+# Board, turn and result of one game, plus Zobrist hashes kept up to date move by move
 class Connect4Game:
+    # The board is one row-major bytearray (row 0 at the top) of the ASCII codes for ' ', 'X'
+    # and 'O': 42 bytes per game instead of six lists holding 42 string references.
+    __slots__ = ("cells", "current_player_symbol", "game_over", "winner", "is_draw", "zobrist_hash", "mirror_hash")
+
     def __init__(self):
-        self.board = [[' ' for _ in range(7)] for _ in range(6)]
+        self.cells = bytearray(b' ' * 42)
         self.current_player_symbol = "X"
         self.game_over = False
         self.winner = None
         self.is_draw = False
+        # Incrementally maintained hashes of the position and of its left-right mirror image
+        self.zobrist_hash = ZOBRIST_SIDE["X"]
+        self.mirror_hash = ZOBRIST_SIDE["X"]
+
+    @property
+    def board(self):
+        # A fresh nested-list copy (board[r][c] is ' ', 'X' or 'O'); safe to use without the game lock
+        return [list(self.cells[r * 7:r * 7 + 7].decode('ascii')) for r in range(6)]
 
     def get_board_string(self):
         board_str = "\n"
-        for _r_idx, row in enumerate(self.board): # Renamed r_idx to _r_idx as it's not used
+        for row in self.board:
             board_str += "| " + " | ".join(row) + " |\n"
         board_str += "+---" * 7 + "+\n"
         board_str += "| " + " | ".join(map(str, range(7))) + " |\n"
@@ -22,28 +71,33 @@ class Connect4Game:
 
     def is_valid_move(self, col):
         if not (0 <= col < 7): return False
-        return self.board[0][col] == ' '
+        return self.cells[col] == EMPTY_CELL
 
     def make_move(self, col):
         if not self.is_valid_move(col): return False
-        for row in reversed(self.board):
-            if row[col] == ' ':
-                row[col] = self.current_player_symbol
+        for r in range(5, -1, -1):
+            if self.cells[r * 7 + col] == EMPTY_CELL:
+                self.cells[r * 7 + col] = ord(self.current_player_symbol)
+                self.zobrist_hash ^= ZOBRIST_PIECES[self.current_player_symbol][r][col]
+                self.mirror_hash ^= ZOBRIST_PIECES[self.current_player_symbol][r][6 - col]
                 return True
         return False
 
     def check_winner(self):
+        cells = self.cells
         for r in range(6):
             for c in range(7):
-                if self.board[r][c] == ' ': continue
-                if c <= 3 and all(self.board[r][c+i] == self.board[r][c] for i in range(4)): self.winner = self.board[r][c]; return True
-                if r <= 2 and all(self.board[r+i][c] == self.board[r][c] for i in range(4)): self.winner = self.board[r][c]; return True
-                if r <= 2 and c <= 3 and all(self.board[r+i][c+i] == self.board[r][c] for i in range(4)): self.winner = self.board[r][c]; return True
-                if r <= 2 and c >= 3 and all(self.board[r+i][c-i] == self.board[r][c] for i in range(4)): self.winner = self.board[r][c]; return True
+                i = r * 7 + c
+                v = cells[i]
+                if v == EMPTY_CELL: continue
+                # Index steps: 1 along a row, 7 down a column, 8 and 6 along the two diagonals
+                for step, fits in ((1, c <= 3), (7, r <= 2), (8, r <= 2 and c <= 3), (6, r <= 2 and c >= 3)):
+                    if fits and cells[i + step] == v and cells[i + 2 * step] == v and cells[i + 3 * step] == v:
+                        self.winner = chr(v); return True
         return False
 
     def is_board_full(self):
-        if all(self.board[0][c] != ' ' for c in range(7)):
+        if EMPTY_CELL not in self.cells[:7]:
             if not self.winner: # Only a draw if no winner yet
                 self.is_draw = True
             return True
@@ -51,51 +105,792 @@ class Connect4Game:
 
     def switch_player(self):
         self.current_player_symbol = "O" if self.current_player_symbol == "X" else "X"
+        side_swap = ZOBRIST_SIDE["X"] ^ ZOBRIST_SIDE["O"]
+        self.zobrist_hash ^= side_swap
+        self.mirror_hash ^= side_swap
+
+    def board_hash(self):
+        # Hash of the pieces alone, without the side to move
+        return self.zobrist_hash ^ ZOBRIST_SIDE[self.current_player_symbol]
+
+    def to_checkpoint(self):
+        return {"board": [self.cells[r * 7:r * 7 + 7].decode('ascii') for r in range(6)], "turn": self.current_player_symbol,
+                "game_over": self.game_over, "winner": self.winner, "is_draw": self.is_draw}
+
+    def restore_checkpoint(self, data):
+        rows = data["board"]
+        if len(rows) != 6 or any(not isinstance(row, str) or len(row) != 7 or set(row) - {' ', 'X', 'O'} for row in rows):
+            raise ValueError("malformed board")
+        if data["turn"] not in ('X', 'O'): raise ValueError("malformed turn")
+        self.cells = bytearray("".join(rows).encode('ascii'))
+        self.current_player_symbol = data["turn"]
+        self.game_over = bool(data["game_over"])
+        self.winner = data.get("winner")
+        self.is_draw = bool(data.get("is_draw"))
+        self.zobrist_hash = self.mirror_hash = ZOBRIST_SIDE[self.current_player_symbol]
+        for i, v in enumerate(self.cells):
+            if v != EMPTY_CELL:
+                r, c = divmod(i, 7)
+                self.zobrist_hash ^= ZOBRIST_PIECES[chr(v)][r][c]
+                self.mirror_hash ^= ZOBRIST_PIECES[chr(v)][r][6 - c]
+
+    def canonical_hash(self):
+        # (hash, mirrored): the smaller of the position's and its mirror image's hash
+        if self.mirror_hash < self.zobrist_hash: return self.mirror_hash, True
+        return self.zobrist_hash, False
 
     def reset_game(self, starting_player="X"):
-        self.board = [[' ' for _ in range(7)] for _ in range(6)]
+        self.cells = bytearray(b' ' * 42)
         self.current_player_symbol = starting_player
         self.game_over = False
         self.winner = None
         self.is_draw = False
+        self.zobrist_hash = ZOBRIST_SIDE[starting_player] # Empty board: only the side to move contributes
+        self.mirror_hash = ZOBRIST_SIDE[starting_player]
         print(f"Game object reset. Game over: {self.game_over}, Starting player: {self.current_player_symbol}")
 
 
+class LRUCache:
+    # Thread-safe bounded mapping that evicts the least recently used entry when full
+    def __init__(self, capacity=50000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0, "evictions": self.evictions}
+
+
+class PositionAnalyzer:
+    # Scores every column of a position with a depth-limited alpha-beta search, from the
+    # point of view of the player to move. Results are cached under the game's canonical
+    # Zobrist hash, which folds a position and its left-right mirror image into one entry.
+    WIN_SCORE = 100000
+    CENTER_ORDER = (3, 2, 4, 1, 5, 0, 6) # Center-first move ordering prunes far more
+    WINDOWS = [[(r + i * dr, c + i * dc) for i in range(4)]
+               for r in range(6) for c in range(7) for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1))
+               if 0 <= r + 3 * dr < 6 and 0 <= c + 3 * dc < 7]
+
+    def __init__(self, depth=5, cache_size=50000):
+        self.depth = depth
+        self.cache = LRUCache(cache_size)
+
+    def analyze(self, board, to_move, canonical):
+        # Returns (evaluations, cached): one score per column (None if the column is full).
+        # `canonical` is the position's (hash, mirrored) pair from Connect4Game.canonical_hash().
+        key, mirrored = canonical
+        evaluations = self.cache.get(key)
+        cached = evaluations is not None
+        if not cached:
+            evaluations = self.evaluate_columns(board, to_move)
+            self.cache.put(key, evaluations[::-1] if mirrored else evaluations)
+        elif mirrored:
+            evaluations = evaluations[::-1]
+        return list(evaluations), cached
+
+    def evaluate_columns(self, board, to_move):
+        grid = [row[:] for row in board] # Searched in place, so work on a copy
+        opponent = "O" if to_move == "X" else "X"
+        evaluations = []
+        for col in range(7):
+            row = self._drop_row(grid, col)
+            if row is None:
+                evaluations.append(None); continue
+            grid[row][col] = to_move
+            if self._wins_at(grid, row, col, to_move):
+                evaluations.append(self.WIN_SCORE + self.depth)
+            else:
+                evaluations.append(-self._negamax(grid, opponent, self.depth - 1, -self.WIN_SCORE * 2, self.WIN_SCORE * 2))
+            grid[row][col] = ' '
+        return evaluations
+
+    @staticmethod
+    def _drop_row(grid, col):
+        for row in range(5, -1, -1):
+            if grid[row][col] == ' ': return row
+        return None
+
+    @staticmethod
+    def _wins_at(grid, row, col, symbol):
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            count = 1
+            for sign in (1, -1):
+                r, c = row + dr * sign, col + dc * sign
+                while 0 <= r < 6 and 0 <= c < 7 and grid[r][c] == symbol:
+                    count += 1; r += dr * sign; c += dc * sign
+            if count >= 4: return True
+        return False
+
+    def _negamax(self, grid, to_move, depth, alpha, beta):
+        if depth == 0: return self._heuristic(grid, to_move)
+        opponent = "O" if to_move == "X" else "X"
+        best = None
+        for col in self.CENTER_ORDER:
+            row = self._drop_row(grid, col)
+            if row is None: continue
+            grid[row][col] = to_move
+            if self._wins_at(grid, row, col, to_move):
+                score = self.WIN_SCORE + depth # Prefer quicker wins
+            else:
+                score = -self._negamax(grid, opponent, depth - 1, -beta, -alpha)
+            grid[row][col] = ' '
+            if best is None or score > best: best = score
+            if score > alpha: alpha = score
+            if alpha >= beta: break
+        return 0 if best is None else best # Board full: draw
+
+    def _heuristic(self, grid, to_move):
+        score = 0
+        for window in self.WINDOWS:
+            mine = theirs = 0
+            for r, c in window:
+                cell = grid[r][c]
+                if cell == to_move: mine += 1
+                elif cell != ' ': theirs += 1
+            if theirs == 0: score += (0, 1, 4, 16, 0)[mine]
+            elif mine == 0: score -= (0, 1, 4, 16, 0)[theirs]
+        for r in range(6):
+            cell = grid[r][3]
+            if cell == to_move: score += 3
+            elif cell != ' ': score -= 3
+        return score
+
+
+class PositionIndex:
+    # Counts how often each position (by Zobrist hash) has been reached. Open addressing with
+    # linear probing over two flat arrays, 12 bytes per slot, instead of a dict entry per
+    # position. Key 0 marks an empty slot.
+    SNAPSHOT_HEADER = struct.Struct("<4sHxxQQ") # magic, version, size, capacity
+    SNAPSHOT_MAGIC = b"C4PI"
+    SNAPSHOT_VERSION = 1
+    MAX_COUNT = 2 ** 32 - 1
+    LOAD_HEADROOM = 4 # A loaded index is rebuilt at 1/4 load, so play does not trigger a full rehash soon
+
+    def __init__(self, capacity=1024):
+        capacity = 1 << max(4, (capacity - 1).bit_length()) # Power of two so probing can mask
+        self.keys = array('Q', bytes(8 * capacity))
+        self.counts = array('I', bytes(4 * capacity))
+        self.size = 0
+
+    def _find_slot(self, key):
+        mask = len(self.keys) - 1
+        slot = key & mask # Zobrist hashes are uniformly random, so the low bits index well
+        while self.keys[slot] != 0 and self.keys[slot] != key:
+            slot = (slot + 1) & mask
+        return slot
+
+    def add(self, key):
+        key = key or 1 # 0 is reserved for empty slots
+        slot = self._find_slot(key)
+        if self.keys[slot] == 0:
+            self.keys[slot] = key
+            self.size += 1
+        if self.counts[slot] < self.MAX_COUNT: self.counts[slot] += 1
+        if self.size * 10 > len(self.keys) * 7: self._grow() # Keep load factor under 0.7
+        return self.counts[self._find_slot(key)]
+
+    def count(self, key):
+        key = key or 1
+        return self.counts[self._find_slot(key)]
+
+    def _grow(self):
+        old_keys, old_counts = self.keys, self.counts
+        self.keys = array('Q', bytes(8 * len(old_keys) * 2))
+        self.counts = array('I', bytes(4 * len(old_keys) * 2))
+        for key, count in zip(old_keys, old_counts):
+            if key:
+                slot = self._find_slot(key)
+                self.keys[slot] = key
+                self.counts[slot] = count
+
+    def most_common(self, n=10):
+        return heapq.nlargest(n, ((count, key) for key, count in zip(self.keys, self.counts) if key))
+
+    def copy(self):
+        # Two array copies, cheap enough to take under game_lock; analytics then run on the copy
+        clone = PositionIndex(capacity=16)
+        clone.keys, clone.counts, clone.size = array('Q', self.keys), array('I', self.counts), self.size
+        return clone
+
+    def snapshot_bytes(self):
+        keys, counts = array('Q', self.keys), array('I', self.counts)
+        if sys.byteorder == "big": keys.byteswap(); counts.byteswap() # Snapshots are little-endian
+        header = self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, self.size, len(keys))
+        return header + keys.tobytes() + counts.tobytes()
+
+    @classmethod
+    def load(cls, path):
+        # Rebuilds the table from the snapshot's (key, count) pairs rather than trusting its
+        # layout, sized so growth does not rehash everything during a move under game_lock
+        index = cls()
+        try:
+            with open(path, "rb") as f: data = f.read()
+            magic, version, size, capacity = cls.SNAPSHOT_HEADER.unpack_from(data)
+            if magic != cls.SNAPSHOT_MAGIC or version != cls.SNAPSHOT_VERSION:
+                print(f"Ignoring position index {path}: unknown format."); return index
+            if capacity < 16 or capacity & (capacity - 1) or size > capacity:
+                print(f"Ignoring position index {path}: malformed header."); return index
+            offset = cls.SNAPSHOT_HEADER.size
+            keys, counts = array('Q'), array('I')
+            keys.frombytes(data[offset:offset + 8 * capacity])
+            counts.frombytes(data[offset + 8 * capacity:offset + 12 * capacity])
+            if len(keys) != capacity or len(counts) != capacity:
+                print(f"Ignoring position index {path}: truncated."); return index
+            if sys.byteorder == "big": keys.byteswap(); counts.byteswap()
+            entries = [(key, count) for key, count in zip(keys, counts) if key and count]
+            index = cls(capacity=max(1024, len(entries) * cls.LOAD_HEADROOM))
+            for key, count in entries:
+                slot = index._find_slot(key)
+                if index.keys[slot] == 0:
+                    index.keys[slot] = key
+                    index.size += 1
+                index.counts[slot] = min(cls.MAX_COUNT, index.counts[slot] + count)
+            print(f"Loaded position index from {path}: {index.size} positions.")
+        except FileNotFoundError:
+            pass
+        except (OSError, struct.error) as e:
+            print(f"Could not load position index {path}: {e}")
+        return index
+
+
+class _WheelTimer:
+    __slots__ = ("expires", "callback", "args", "slot")
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires # Absolute tick at which the timer fires
+        self.callback = callback
+        self.args = args
+        self.slot = None # The wheel slot (a set) currently holding this timer
+
+
+class TimerWheel:
+    # Hierarchical timing wheel shared by every connection on the server.
+    # Level 0 has `slots` buckets of `tick` seconds; each higher level covers `slots` times
+    # the span of the level below. Scheduling and cancelling are O(1); timers on higher
+    # levels are cascaded down as the wheel turns. The driver thread only wakes when
+    # there is something to do, so idle connections cost no wakeups of their own.
+    def __init__(self, tick=0.1, slots=64, levels=4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.max_ticks = slots ** levels - 1
+        self.current_tick = 0
+        self.timer_count = 0
+        self.start_time = time.monotonic()
+        self.cond = threading.Condition()
+        self.running = False
+
+    def _place(self, timer):
+        delta = timer.expires - self.current_tick
+        level, span = 0, 1
+        while level < self.levels - 1 and delta >= span * self.slots:
+            level += 1
+            span *= self.slots
+        timer.slot = self.wheels[level][(timer.expires // span) % self.slots]
+        timer.slot.add(timer)
+
+    def _now_tick(self):
+        return int((time.monotonic() - self.start_time) / self.tick)
+
+    def schedule(self, delay, callback, *args):
+        with self.cond:
+            if self.timer_count == 0: # Wheel was parked; re-anchor it to the current time
+                self.start_time = time.monotonic() - self.current_tick * self.tick
+            ticks = min(max(1, int(delay / self.tick + 0.999)), self.max_ticks)
+            # The driver may not have caught up with the wall clock yet, so count from real time
+            timer = _WheelTimer(max(self.current_tick, self._now_tick()) + ticks, callback, args)
+            self._place(timer)
+            self.timer_count += 1
+            self.cond.notify() # New timer may be due before whatever the driver is waiting on
+            return timer
+
+    def cancel(self, timer):
+        with self.cond:
+            if timer is not None and timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+                self.timer_count -= 1
+
+    def _advance(self, due):
+        # Move the wheel one tick forward; expired timers are appended to `due`
+        self.current_tick += 1
+        span = self.slots ** (self.levels - 1)
+        for level in range(self.levels - 1, 0, -1): # Cascade higher levels first
+            if self.current_tick % span == 0:
+                slot = self.wheels[level][(self.current_tick // span) % self.slots]
+                cascading = list(slot)
+                slot.clear()
+                for timer in cascading: self._place(timer)
+            span //= self.slots
+        slot = self.wheels[0][self.current_tick % self.slots]
+        for timer in slot:
+            timer.slot = None
+            due.append(timer)
+        self.timer_count -= len(slot)
+        slot.clear()
+
+    def _ticks_until_next_event(self):
+        # Next occupied level-0 slot, or the next cascade boundary if level 0 is empty
+        for offset in range(1, self.slots + 1):
+            tick = self.current_tick + offset
+            if self.wheels[0][tick % self.slots] or tick % self.slots == 0:
+                return offset
+        return self.slots
+
+    def run(self):
+        self.running = True
+        while self.running:
+            due = []
+            with self.cond:
+                if self.timer_count == 0:
+                    self.cond.wait() # Nothing scheduled: sleep until schedule() or stop()
+                    continue
+                wake_at = self.start_time + (self.current_tick + self._ticks_until_next_event()) * self.tick
+                timeout = wake_at - time.monotonic()
+                if timeout > 0:
+                    self.cond.wait(timeout)
+                now_tick = self._now_tick()
+                while self.current_tick < now_tick:
+                    self._advance(due)
+            for timer in due: # Run callbacks outside the wheel lock so they may reschedule
+                try: timer.callback(*timer.args)
+                except Exception as e: print(f"Timer callback {getattr(timer.callback, '__name__', timer.callback)} failed: {e}")
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+
+class HeapScheduler:
+    # Deadline scheduler backed by a binary heap and a single driver thread that sleeps
+    # until the earliest deadline. Cancelled entries are discarded lazily when they reach
+    # the top of the heap, so cancel is O(1) and schedule is O(log n).
+    def __init__(self):
+        self.heap = [] # Entries are [deadline, seq, callback, args, cancelled]
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = False
+
+    def schedule(self, delay, callback, *args):
+        with self.cond:
+            entry = [time.monotonic() + delay, next(self.seq), callback, args, False]
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry: self.cond.notify() # New earliest deadline
+            return entry
+
+    def cancel(self, entry):
+        if entry is not None:
+            entry[4] = True
+
+    def run(self):
+        self.running = True
+        while self.running:
+            with self.cond:
+                while self.heap and self.heap[0][4]: heapq.heappop(self.heap)
+                if not self.heap:
+                    self.cond.wait(); continue
+                timeout = self.heap[0][0] - time.monotonic()
+                if timeout > 0:
+                    self.cond.wait(timeout); continue
+                entry = heapq.heappop(self.heap)
+            try: entry[2](*entry[3])
+            except Exception as e: print(f"Scheduled callback {getattr(entry[2], '__name__', entry[2])} failed: {e}")
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+
+class GameClock:
+    # Per-game chess-style clock. `base_time` is each player's total budget for the game
+    # (None for no game limit), `increment` is added after every completed move, and
+    # `move_time` caps any single move (None for no per-move limit).
+    __slots__ = ("base_time", "increment", "move_time", "remaining", "running_symbol", "turn_started")
+
+    def __init__(self, base_time=None, increment=0.0, move_time=None):
+        self.base_time = base_time
+        self.increment = increment
+        self.move_time = move_time
+        self.reset()
+
+    @property
+    def enabled(self):
+        return self.base_time is not None or self.move_time is not None
+
+    def reset(self):
+        self.remaining = {'X': self.base_time, 'O': self.base_time}
+        self.running_symbol = None
+        self.turn_started = None
+
+    def start_turn(self, symbol, now):
+        self.running_symbol = symbol
+        self.turn_started = now
+
+    def stop_turn(self, now, completed_move=False):
+        # Charges the running player for the time used; the increment is only earned by moving
+        symbol = self.running_symbol
+        if symbol is None: return
+        if self.base_time is not None:
+            self.remaining[symbol] -= now - self.turn_started
+            if completed_move: self.remaining[symbol] += self.increment
+        self.running_symbol = None
+        self.turn_started = None
+
+    def time_left(self, now):
+        # Seconds until the running player's flag falls
+        if self.running_symbol is None: return None
+        elapsed = now - self.turn_started
+        limits = []
+        if self.base_time is not None: limits.append(self.remaining[self.running_symbol] - elapsed)
+        if self.move_time is not None: limits.append(self.move_time - elapsed)
+        return max(0.0, min(limits))
+
+    def to_checkpoint(self, now):
+        remaining = dict(self.remaining)
+        if self.running_symbol is not None and remaining[self.running_symbol] is not None:
+            remaining[self.running_symbol] -= now - self.turn_started
+        return {"remaining": remaining}
+
+    def restore_checkpoint(self, data):
+        # Time already used survives a restart; the running turn restarts when play resumes
+        self.reset()
+        if self.base_time is None: return
+        for symbol, seconds in data.get("remaining", {}).items():
+            if symbol in self.remaining and seconds is not None:
+                self.remaining[symbol] = max(0.0, float(seconds))
+
+    def snapshot(self, now):
+        clock = {"move_time": self.move_time, "turn_time_left": None}
+        for symbol in ('X', 'O'):
+            remaining = self.remaining[symbol]
+            if remaining is not None and symbol == self.running_symbol:
+                remaining -= now - self.turn_started
+            clock[symbol] = None if remaining is None else round(max(0.0, remaining), 1)
+        if self.running_symbol is not None:
+            clock["turn_time_left"] = round(self.time_left(now), 1)
+        return clock
+
+
+class TokenBucket:
+    # Classic token bucket: refills at `rate` tokens per second up to `burst`
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def consume(self, tokens=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+class ConnectionSet:
+    # Insertion-ordered set of client sockets backed by a dict: add, remove and `in` are O(1),
+    # where a list's remove and membership test scan every connection
+    __slots__ = ("_sockets",)
+
+    def __init__(self):
+        self._sockets = {}
+
+    def add(self, sock):
+        self._sockets[sock] = None
+
+    def remove(self, sock):
+        del self._sockets[sock]
+
+    def __contains__(self, sock):
+        return sock in self._sockets
+
+    def __len__(self):
+        return len(self._sockets)
+
+    def __iter__(self):
+        return iter(self._sockets)
+
+    def __getitem__(self, index):
+        # Walks the set; only used to pick out the two seated players
+        return list(self._sockets)[index]
+
+
+class ConnectionRecord:
+    # Everything the server tracks for one connected socket. Fixed slots instead of a dict
+    # keep an idle connection's footprint small and make a misspelt field an AttributeError.
+    __slots__ = ("symbol", "rematch_requested", "opponent_socket", "ip", "resume_token", "last_seen", "ping_seq",
+                 "handshake_timer", "heartbeat_timer", "idle_timer")
+
+    def __init__(self, symbol, ip=None, resume_token=None):
+        self.symbol = symbol
+        self.rematch_requested = False
+        self.opponent_socket = None
+        self.ip = ip
+        self.resume_token = resume_token # None while restoring: seats are then only granted by reclaiming one
+        self.last_seen = time.monotonic()
+        self.ping_seq = 0
+        self.handshake_timer = None # Timer wheel entries; see Connect4Server.arm_connection_timers
+        self.heartbeat_timer = None
+        self.idle_timer = None
+
+    def timers(self):
+        return (self.handshake_timer, self.heartbeat_timer, self.idle_timer) # TimerWheel.cancel ignores None
+
+
+class ServerProfiler:
+    # Opt-in instrumentation for the server. Every hook checks `enabled` first, so leaving
+    # it compiled in costs one attribute lookup per call while it is switched off.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+        self.capture_thread = None
+        self.last_capture = None # Hot spots from the most recent sampling capture
+
+    def reset(self):
+        with self.lock:
+            self.timings = {} # name -> [count, wall_total, cpu_total, wall_max]
+            self.lock_wait = [0, 0.0, 0.0] # count, total, max seconds spent waiting for game_lock
+            self.lock_hold = [0, 0.0, 0.0] # count, total, max seconds game_lock was held
+
+    def start(self):
+        # Returns a token for stop(), or None while disabled
+        if not self.enabled: return None
+        return time.perf_counter(), time.thread_time()
+
+    def stop(self, name, started):
+        wall = time.perf_counter() - started[0]
+        cpu = time.thread_time() - started[1]
+        with self.lock:
+            entry = self.timings.get(name)
+            if entry is None: entry = self.timings[name] = [0, 0.0, 0.0, 0.0]
+            entry[0] += 1; entry[1] += wall; entry[2] += cpu
+            if wall > entry[3]: entry[3] = wall
+
+    def record_lock(self, stats, seconds):
+        with self.lock:
+            stats[0] += 1; stats[1] += seconds
+            if seconds > stats[2]: stats[2] = seconds
+
+    def report(self, top=10):
+        def ms(seconds): return round(seconds * 1000, 3)
+        with self.lock:
+            ranked = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            report = {
+                "enabled": self.enabled,
+                "timings": [{"name": name, "count": count, "wall_ms": ms(wall), "cpu_ms": ms(cpu),
+                             "avg_wall_ms": ms(wall / count), "max_wall_ms": ms(wall_max)}
+                            for name, (count, wall, cpu, wall_max) in ranked],
+                "lock_wait": {"count": self.lock_wait[0], "total_ms": ms(self.lock_wait[1]), "max_ms": ms(self.lock_wait[2])},
+                "lock_hold": {"count": self.lock_hold[0], "total_ms": ms(self.lock_hold[1]), "max_ms": ms(self.lock_hold[2])},
+            }
+        if self.last_capture: report["last_capture"] = self.last_capture
+        return report
+
+    def start_capture(self, seconds, path, interval=0.005):
+        # Wall-clock sampling of every thread's stack. Unlike cProfile this sees all client
+        # threads, not just the caller. Writes collapsed stacks (flamegraph input) to `path`.
+        if self.capture_thread and self.capture_thread.is_alive(): return False
+        self.capture_thread = threading.Thread(target=self._sample, args=(seconds, path, interval), daemon=True)
+        self.capture_thread.start()
+        return True
+
+    def _sample(self, seconds, path, interval):
+        stacks, leaves = Counter(), Counter()
+        own_id = threading.get_ident()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id: continue
+                leaves[f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"] += 1
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        try:
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common(): f.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"Could not write profile {path}: {e}")
+        self.last_capture = {"path": path, "seconds": seconds, "samples": samples,
+                             "hot_spots": [{"frame": leaf, "samples": count} for leaf, count in leaves.most_common(10)]}
+        print(f"Profile capture written to {path} ({samples} samples).")
+
+
+class ProfiledLock:
+    # Stand-in for threading.Lock that reports wait and hold times to a ServerProfiler.
+    # Only supports use as a context manager, which is how game_lock is always taken.
+    def __init__(self, profiler):
+        self._lock = threading.Lock()
+        self.profiler = profiler
+        self._acquired_at = None # Only the holder touches this, so the lock itself protects it
+
+    def __enter__(self):
+        if not self.profiler.enabled:
+            self._lock.acquire()
+            self._acquired_at = None
+            return self
+        requested_at = time.perf_counter()
+        self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        self.profiler.record_lock(self.profiler.lock_wait, self._acquired_at - requested_at)
+        return self
+
+    def __exit__(self, *exc_info):
+        acquired_at = self._acquired_at
+        held = time.perf_counter() - acquired_at if acquired_at is not None else None
+        self._lock.release()
+        if held is not None: self.profiler.record_lock(self.profiler.lock_hold, held)
+
+
 class Connect4Server:
-    def __init__(self, port=5555):
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Message types with their own profiler bucket; anything else a client sends is timed as
+    # "msg:other" so arbitrary type strings cannot grow the profiler's table
+    CLIENT_MESSAGE_TYPES = frozenset(("make_move", "request_rematch", "analyze_position", "analysis_stats",
+                                      "hello", "pong", "quit_session"))
+    PROFILE_NAME = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.-]{0,99}") # Plain file names only, never paths
+    MAX_CAPTURE_SECONDS = 300.0
+
+    def __init__(self, port=5555, heartbeat_interval=5.0, idle_timeout=15.0, handshake_timeout=5.0,
+                 base_time=None, increment=0.0, move_time=None,
+                 position_index_path="connect4_positions.idx", index_snapshot_interval=300.0,
+                 admin_port=5556, profile=False, profile_dir="connect4_profiles",
+                 message_rate=10.0, message_burst=20, ip_message_rate=25.0, ip_message_burst=50,
+                 handshake_rate=5.0, handshake_burst=10, max_connections_per_ip=2, max_message_bytes=8192,
+                 checkpoint_path="connect4_checkpoint_{port}.json", checkpoint_interval=10.0,
+                 max_checkpoint_age=300.0, reclaim_timeout=60.0, handoff_path="connect4_server_{port}.sock",
+                 thread_stack_size=512 * 1024):
         self.host_ip = '0.0.0.0'
         self.port = port
-        try:
-            self.server_socket.bind((self.host_ip, self.port))
-        except socket.error as e:
-            print(f"Error binding: {e}"); exit()
-        self.server_socket.listen(2)
-        print(f"Server started on all interfaces, port {self.port}")
+        self.handoff_path = handoff_path.format(port=port) if handoff_path and HANDOFF_SUPPORTED else None
+        self.handed_off = False    # Set once a newer process owns our listening socket and state
+        self.shutting_down = False
+        inherited_sockets = self.take_over_from_running_server()
+        if inherited_sockets:
+            self.server_socket, inherited_admin_socket = inherited_sockets
+            print(f"Took over the listening socket of the running server on port {self.port}")
+        else:
+            inherited_admin_socket = None
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                self.server_socket.bind((self.host_ip, self.port))
+            except socket.error as e:
+                print(f"Error binding: {e}"); exit()
+            self.server_socket.listen(2)
+            print(f"Server started on all interfaces, port {self.port}")
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair() # Lets other threads interrupt the accept loop
 
-        self.clients = [] # List of active client sockets
-        self.client_data = {} # socket -> {"symbol": 'X', "rematch_requested": False, "opponent_socket": opponent_sock}
+        self.clients = ConnectionSet() # Active client sockets, in connection order
+        self.client_data = {} # socket -> ConnectionRecord
         
         self.game = Connect4Game()
-        self.game_lock = threading.Lock() # Protects shared resources: clients, client_data, game, game_active, current_turn_client, session_scores, current_session_starting_player
+        self.profiler = ServerProfiler() # Toggle at runtime through the admin port
+        self.profiler.enabled = profile
+        self.profile_dir = profile_dir # profile_capture output only ever goes in here
+        self.game_lock = ProfiledLock(self.profiler) # Protects shared resources: clients, client_data, game, game_active, current_turn_client, session_scores, current_session_starting_player
         
         self.game_active = False # True when 2 players are in an active game or deciding rematch
         self.current_turn_client = None
-        self.client_threads = {} # socket -> thread object
+        # Per-client handler threads only block in recv and send; the 8 MB default stack is mostly
+        # unused. Headroom is kept for json's recursion on deeply nested (but size-capped) messages.
+        self.thread_stack_size = thread_stack_size # None keeps the platform default
         
         # Session specific, reset when new pair of players start their first game
         self.session_scores = {'X': 0, 'O': 0}
         self.current_session_starting_player = "X"
 
+        # Liveness: one shared timer wheel drives every connection's deadlines
+        self.heartbeat_interval = heartbeat_interval # Ping a client after this long without hearing from it
+        self.idle_timeout = idle_timeout             # Reap a client after this long without hearing from it
+        self.handshake_timeout = handshake_timeout   # A new client must send its first message within this time
+        self.timers = TimerWheel()
+
+        # Admission control. The two player seats are the cap on concurrent connections;
+        # these limits stop one host from flooding the accept loop or the game_lock.
+        self.message_rate, self.message_burst = message_rate, message_burst             # Per connection
+        self.ip_message_rate, self.ip_message_burst = ip_message_rate, ip_message_burst # Per source IP
+        self.max_connections_per_ip = max_connections_per_ip
+        self.max_message_bytes = max_message_bytes # Longest line we will buffer waiting for a newline
+        self.handshake_bucket = TokenBucket(handshake_rate, handshake_burst) # New connections, server-wide
+        self.admission_lock = threading.Lock() # Guards the per-IP tables and counters below (never game_lock)
+        self.connections_per_ip = Counter()
+        self.ip_message_buckets = {} # ip -> TokenBucket, kept while the IP has a connection
+        self.rejections = Counter() # reason -> count, exported through the admin port
+        self.admin_socket = inherited_admin_socket or self.open_admin_socket(admin_port)
+
+        # Time controls: one heap scheduler drives the flag-fall deadline for the game
+        self.clock = GameClock(base_time=base_time, increment=increment, move_time=move_time)
+        self.clock_scheduler = HeapScheduler()
+        self.flag_timer = None # Pending flag-fall entry for the player to move
+
+        self.analyzer = PositionAnalyzer() # Hints and post-move review; shared cache across games
+
+        # Popularity of every position reached in any game; snapshotted to disk by the timer wheel
+        self.position_index_path = position_index_path # None disables persistence
+        self.index_snapshot_interval = index_snapshot_interval
+        self.position_index = PositionIndex.load(position_index_path) if position_index_path else PositionIndex()
+
+        # Checkpoint / hot restart: live game state is saved periodically and on shutdown, and a
+        # restarted server gives players `reclaim_timeout` seconds to take their seats back
+        self.checkpoint_path = checkpoint_path.format(port=port) if checkpoint_path else None
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoint_age = max_checkpoint_age # Older checkpoints are ignored at startup
+        self.reclaim_timeout = reclaim_timeout
+        self.restoring = False     # True while restored seats are waiting to be reclaimed
+        self.restored_seats = {}   # resume_token -> {"symbol": 'X', "rematch_requested": False}
+        self.reclaim_timer = None
+        # Serializes checkpoint and index writes with the handoff, so a periodic save that built
+        # its data earlier can never replace the final handoff files. Taken before game_lock.
+        self.state_file_lock = threading.Lock()
+        self.load_checkpoint()
+        self.handoff_socket = self.open_handoff_socket()
+
 
     def send_json(self, client_socket, data):
         try:
             if client_socket.fileno() == -1: # Check if socket is already closed
-                print(f"Attempted to send on a closed socket for symbol {self.client_data.get(client_socket, {}).get('symbol', 'Unknown')}")
+                print(f"Attempted to send on a closed socket for symbol {self.symbol_of(client_socket, 'Unknown')}")
                 self.handle_disconnection(client_socket) # Ensure cleanup if not already done
                 return
+            started = self.profiler.start()
             message = json.dumps(data) + '\n'
+            if started: self.profiler.stop("json_encode", started)
             client_socket.sendall(message.encode('utf-8'))
         except (socket.error, BrokenPipeError, OSError) as e: # Added OSError for fileno() issues after close
             print(f"Error sending JSON: {e}")
@@ -115,32 +910,427 @@ class Connect4Server:
         # Assumes lock is held if self.client_data is modified concurrently
         client_info = self.client_data.get(client_socket)
         if client_info:
-            return client_info.get("opponent_socket")
+            return client_info.opponent_socket
         return None
 
+    def symbol_of(self, client_socket, default=None):
+        client_info = self.client_data.get(client_socket)
+        return client_info.symbol if client_info else default
+
+
+    def note_client_activity(self, client_socket):
+        # Called on every successful recv, before rate limiting, so it must stay off game_lock:
+        # the dict lookup and the attribute store are each atomic. Deadlines are checked lazily
+        # when their timers fire. Only the first message takes the lock, to cancel the handshake timer.
+        client_info = self.client_data.get(client_socket)
+        if not client_info: return
+        client_info.last_seen = time.monotonic()
+        if client_info.handshake_timer:
+            with self.game_lock:
+                if client_info.handshake_timer: # The handshake timeout may have fired meanwhile
+                    self.timers.cancel(client_info.handshake_timer)
+                    client_info.handshake_timer = None
+
+    def arm_connection_timers(self, client_socket):
+        # This function MUST be called with self.game_lock already acquired
+        client_info = self.client_data[client_socket]
+        client_info.last_seen = time.monotonic()
+        client_info.handshake_timer = self.timers.schedule(self.handshake_timeout, self.on_handshake_timeout, client_socket)
+        client_info.heartbeat_timer = self.timers.schedule(self.heartbeat_interval, self.on_heartbeat_due, client_socket)
+        client_info.idle_timer = self.timers.schedule(self.idle_timeout, self.on_idle_timeout, client_socket)
+
+    def on_handshake_timeout(self, client_socket):
+        with self.game_lock:
+            client_info = self.client_data.get(client_socket)
+            if client_info and client_info.handshake_timer:
+                client_info.handshake_timer = None
+                print(f"Player {client_info.symbol} sent nothing within {self.handshake_timeout}s of connecting. Dropping.")
+                self.handle_disconnection(client_socket)
+
+    def on_heartbeat_due(self, client_socket):
+        with self.game_lock:
+            client_info = self.client_data.get(client_socket)
+            if not client_info: return
+            quiet_for = time.monotonic() - client_info.last_seen
+            if quiet_for >= self.heartbeat_interval:
+                client_info.ping_seq += 1
+                self.send_json(client_socket, {"type": "ping", "payload": {"seq": client_info.ping_seq}})
+                next_due = self.heartbeat_interval
+            else: # Heard from the client recently; no ping needed yet
+                next_due = self.heartbeat_interval - quiet_for
+            if client_socket in self.client_data: # send_json may have cleaned up a dead socket
+                client_info.heartbeat_timer = self.timers.schedule(next_due, self.on_heartbeat_due, client_socket)
+
+    def on_idle_timeout(self, client_socket):
+        with self.game_lock:
+            client_info = self.client_data.get(client_socket)
+            if not client_info: return
+            quiet_for = time.monotonic() - client_info.last_seen
+            if quiet_for < self.idle_timeout: # Activity since this timer was armed; push the deadline out
+                client_info.idle_timer = self.timers.schedule(self.idle_timeout - quiet_for, self.on_idle_timeout, client_socket)
+                return
+            print(f"Player {client_info.symbol} silent for {quiet_for:.1f}s. Reaping connection.")
+            self.handle_disconnection(client_socket)
+
+    def start_turn_clock(self):
+        # This function MUST be called with self.game_lock already acquired.
+        # Starts the clock for game.current_player_symbol and arms its flag-fall deadline.
+        if not self.clock.enabled: return
+        self.clock_scheduler.cancel(self.flag_timer)
+        now = time.monotonic()
+        self.clock.start_turn(self.game.current_player_symbol, now)
+        self.flag_timer = self.clock_scheduler.schedule(self.clock.time_left(now), self.on_flag_fall, self.game.current_player_symbol)
+
+    def stop_turn_clock(self, completed_move=False):
+        # This function MUST be called with self.game_lock already acquired
+        self.clock_scheduler.cancel(self.flag_timer)
+        self.flag_timer = None
+        self.clock.stop_turn(time.monotonic(), completed_move)
+
+    def clock_payload(self):
+        return self.clock.snapshot(time.monotonic()) if self.clock.enabled else None
+
+    def finish_game(self, game_over_payload):
+        # This function MUST be called with self.game_lock already acquired
+        self.stop_turn_clock()
+        self.game.game_over = True
+        game_over_payload["clock"] = self.clock_payload()
+        if self.game.winner: self.session_scores[self.game.winner] += 1
+        # self.game_active remains True until rematch decision or disconnect
+        self.broadcast_json({"type": "game_over", "payload": game_over_payload})
+        self.broadcast_json({"type": "score_update", "payload": {"scores": self.session_scores}})
+        for client_info in self.client_data.values(): client_info.rematch_requested = False
+        print(f"Game over. Winner: {self.game.winner}, Draw: {self.game.is_draw}. Scores: {self.session_scores}")
+
+    def on_flag_fall(self, flagged_symbol):
+        with self.game_lock:
+            # Ignore stale deadlines: the move may have been made just before we got the lock
+            if not self.game_active or self.game.game_over or self.game.current_player_symbol != flagged_symbol:
+                return
+            time_left = self.clock.time_left(time.monotonic())
+            if time_left is None: return
+            if time_left > 0: # Woke early; re-arm for the remainder
+                self.flag_timer = self.clock_scheduler.schedule(time_left, self.on_flag_fall, flagged_symbol)
+                return
+            self.flag_fall(flagged_symbol)
+
+    def flag_fall(self, flagged_symbol):
+        # This function MUST be called with self.game_lock already acquired
+        self.game.winner = "O" if flagged_symbol == "X" else "X"
+        print(f"Player {flagged_symbol} ran out of time.")
+        self.finish_game({"winner": self.game.winner, "timeout": True,
+                          "message": f"Player {flagged_symbol} ran out of time. Player {self.game.winner} wins!",
+                          "board": self.game.get_board_string()})
+
+    def save_position_index(self):
+        if not self.position_index_path: return
+        with self.state_file_lock:
+            if self.handed_off: return # The new process owns the file now
+            with self.game_lock: # Copying the arrays is quick; do the file I/O without the lock
+                data = self.position_index.snapshot_bytes()
+            try:
+                write_file_atomically(self.position_index_path, data)
+            except OSError as e:
+                print(f"Could not save position index: {e}")
+
+    def on_index_snapshot_due(self):
+        self.save_position_index()
+        self.timers.schedule(self.index_snapshot_interval, self.on_index_snapshot_due)
+
+    CHECKPOINT_VERSION = 1
+
+    def checkpoint_bytes(self):
+        # This function MUST be called with self.game_lock already acquired
+        seats = [{"symbol": info.symbol, "token": info.resume_token, "rematch_requested": info.rematch_requested}
+                 for sock, info in self.client_data.items() if sock in self.clients and info.resume_token]
+        if self.restoring:
+            seats += [{"symbol": seat["symbol"], "token": token, "rematch_requested": seat["rematch_requested"]}
+                      for token, seat in self.restored_seats.items()]
+        elif not self.game_active:
+            seats = [] # No game in progress, so nothing worth restoring
+        checkpoint = {"version": self.CHECKPOINT_VERSION, "saved_at": time.time(), "game": self.game.to_checkpoint(),
+                      "clock": self.clock.to_checkpoint(time.monotonic()), "scores": self.session_scores,
+                      "starting_player": self.current_session_starting_player, "seats": seats}
+        return json.dumps(checkpoint, separators=(",", ":")).encode('utf-8')
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path: return
+        with self.state_file_lock:
+            if self.handed_off: return # The new process owns the file now
+            with self.game_lock:
+                data = self.checkpoint_bytes()
+            try:
+                write_file_atomically(self.checkpoint_path, data)
+            except OSError as e:
+                print(f"Could not save checkpoint: {e}")
+
+    def on_checkpoint_due(self):
+        self.save_checkpoint()
+        self.timers.schedule(self.checkpoint_interval, self.on_checkpoint_due)
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path: return
+        try:
+            with open(self.checkpoint_path, "rb") as f: checkpoint = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring checkpoint {self.checkpoint_path}: {e}"); return
+        if not isinstance(checkpoint, dict) or checkpoint.get("version") != self.CHECKPOINT_VERSION:
+            print(f"Ignoring checkpoint {self.checkpoint_path}: unknown version."); return
+        age = time.time() - checkpoint.get("saved_at", 0)
+        if age > self.max_checkpoint_age or not checkpoint.get("seats"): return
+        try:
+            self.game.restore_checkpoint(checkpoint["game"])
+            self.clock.restore_checkpoint(checkpoint.get("clock", {}))
+            self.session_scores = {symbol: int(checkpoint["scores"].get(symbol, 0)) for symbol in ('X', 'O')}
+            self.current_session_starting_player = checkpoint.get("starting_player", "X")
+            self.restored_seats = {seat["token"]: {"symbol": seat["symbol"], "rematch_requested": bool(seat.get("rematch_requested"))}
+                                   for seat in checkpoint["seats"]}
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            print(f"Ignoring checkpoint {self.checkpoint_path}: {e}")
+            self.game.reset_game("X"); self.clock.reset(); self.restored_seats = {}
+            self.session_scores = {'X': 0, 'O': 0}; self.current_session_starting_player = "X"
+            return
+        self.restoring = True
+        self.reclaim_timer = self.timers.schedule(self.reclaim_timeout, self.on_reclaim_timeout)
+        print(f"Restored game from checkpoint ({age:.1f}s old). Waiting up to {self.reclaim_timeout}s for players to reclaim their seats.")
+
+    def reclaim_seat(self, client_socket, token):
+        # This function MUST be called with self.game_lock already acquired
+        client_info = self.client_data.get(client_socket)
+        if not client_info: return False
+        if client_info.resume_token: return True # Already holds a seat
+        seat = self.restored_seats.pop(token, None) if token else None
+        if seat is None: return False
+        client_info.symbol = seat["symbol"]
+        client_info.rematch_requested = seat["rematch_requested"]
+        client_info.resume_token = token
+        print(f"Player {seat['symbol']} reclaimed their seat.")
+        self.send_welcome(client_socket)
+        if not self.restored_seats: self.finish_restore()
+        return True
+
+    def finish_restore(self):
+        # This function MUST be called with self.game_lock already acquired
+        self.restoring = False
+        self.timers.cancel(self.reclaim_timer)
+        self.reclaim_timer = None
+        print("All seats reclaimed. Resuming the restored game.")
+        self.pair_clients(resume=True)
+
+    def on_reclaim_timeout(self):
+        with self.game_lock:
+            if not self.restoring: return
+            print(f"Seats were not reclaimed within {self.reclaim_timeout}s. Discarding the restored game.")
+            self.restoring = False
+            self.restored_seats.clear()
+            self.reclaim_timer = None
+            self.game.reset_game(starting_player="X")
+            self.clock.reset()
+            self.session_scores = {'X': 0, 'O': 0}
+            self.current_session_starting_player = "X"
+            for sock in list(self.clients): # Whoever is connected now starts a fresh session
+                client_info = self.client_data.get(sock)
+                if client_info and not client_info.resume_token:
+                    client_info.resume_token = secrets.token_hex(8)
+                    self.send_welcome(sock)
+            if len(self.clients) == 2: self.pair_clients()
+            elif len(self.clients) == 1: self.send_json(self.clients[0], {"type": "info", "payload": {"message": "Waiting for an opponent..."}})
+
+    def send_welcome(self, client_socket):
+        # This function MUST be called with self.game_lock already acquired
+        client_info = self.client_data.get(client_socket)
+        if not client_info: return
+        payload = {"symbol": client_info.symbol, "message": f"Welcome! You are Player {client_info.symbol}."}
+        if client_info.resume_token: payload["resume_token"] = client_info.resume_token # Lets the client reclaim its seat after a restart
+        self.send_json(client_socket, {"type": "welcome", "payload": payload})
+
+    def pair_clients(self, resume=False):
+        # This function MUST be called with self.game_lock already acquired and two clients connected.
+        # Starts a new game for them, or with resume=True continues the game already in self.game.
+        p1_sock, p2_sock = self.clients[0], self.clients[1]
+        p1_info, p2_info = self.client_data[p1_sock], self.client_data[p2_sock]
+        p1_info.opponent_socket = p2_sock
+        p2_info.opponent_socket = p1_sock
+        
+        # Ensure symbols are distinct if assignment logic had issues
+        if p1_info.symbol == p2_info.symbol:
+            p2_info.symbol = "O" if p1_info.symbol == "X" else "X"
+        
+        print(f"Two players connected: {p1_info.symbol} and {p2_info.symbol}. Initializing game...")
+        
+        if not resume:
+            self.game.reset_game(starting_player=self.current_session_starting_player) 
+            self.clock.reset()
+        self.game_active = True
+        
+        p1_sym = p1_info.symbol
+        p2_sym = p2_info.symbol
+
+        if self.game.current_player_symbol == p1_sym: self.current_turn_client = p1_sock
+        elif self.game.current_player_symbol == p2_sym: self.current_turn_client = p2_sock
+        else: # Default if mismatch (shouldn't happen with X/O)
+            self.current_turn_client = p1_sock 
+            print(f"Warning: Game starter {self.game.current_player_symbol} didn't match P1({p1_sym}) or P2({p2_sym}). Defaulting to P1.")
+
+        if resume and self.game.game_over: # Restored while the players were deciding on a rematch
+            if self.game.winner: message = f"Game restored. Player {self.game.winner} won."
+            elif self.game.is_draw: message = "Game restored. It was a draw."
+            else: message = "Game restored."
+            self.broadcast_json({"type": "game_over", "payload": {"winner": self.game.winner, "draw": self.game.is_draw,
+                                                                  "message": message, "board": self.game.get_board_string(),
+                                                                  "clock": self.clock_payload()}})
+            self.broadcast_json({"type": "score_update", "payload": {"scores": self.session_scores}})
+            return
+
+        self.start_turn_clock()
+        verb = "resumed" if resume else "starting"
+        self.broadcast_json({"type": "game_start", "payload": {
+            "board": self.game.get_board_string(),
+            "turn": self.game.current_player_symbol,
+            "message": f"Game {verb}! Player {self.game.current_player_symbol}'s turn.",
+            "scores": self.session_scores,
+            "clock": self.clock_payload()
+        }})
+
+    def take_over_from_running_server(self):
+        # Asks a server already running on this port for its listening (and admin) sockets,
+        # so a restart never has a moment where connections are refused
+        if not self.handoff_path or not os.path.exists(self.handoff_path): return None
+        handoff_conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            handoff_conn.settimeout(10.0)
+            handoff_conn.connect(self.handoff_path)
+            handoff_conn.sendall(b"takeover\n")
+            _message, fds, _flags, _address = socket.recv_fds(handoff_conn, 16, 2)
+        except OSError as e:
+            print(f"No running server to take over from ({e}).")
+            return None
+        finally:
+            handoff_conn.close()
+        if not fds: return None
+        inherited = [socket.socket(fileno=fd) for fd in fds]
+        return inherited[0], (inherited[1] if len(inherited) > 1 else None)
+
+    def open_handoff_socket(self):
+        if not self.handoff_path: return None
+        try: os.unlink(self.handoff_path) # Left behind by a server that did not shut down cleanly
+        except FileNotFoundError: pass
+        except OSError as e:
+            print(f"Handoff socket unavailable ({e}); hot restart disabled."); return None
+        handoff_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            handoff_socket.bind(self.handoff_path)
+            handoff_socket.listen(1)
+            return handoff_socket
+        except OSError as e:
+            print(f"Handoff socket unavailable ({e}); hot restart disabled.")
+            handoff_socket.close()
+            return None
+
+    def run_handoff_listener(self):
+        # Serves one takeover request from a newer server process, then stops this one
+        while True:
+            try: handoff_conn, _address = self.handoff_socket.accept()
+            except OSError: break # Handoff socket closed on shutdown
+            with handoff_conn:
+                try:
+                    handoff_conn.settimeout(5.0)
+                    if handoff_conn.recv(64).strip() != b"takeover": continue
+                    print("A new server process is taking over. Handing off state and listening socket...")
+                    with self.state_file_lock, self.game_lock: # Freeze game state and state files until the new process owns them
+                        if self.checkpoint_path: write_file_atomically(self.checkpoint_path, self.checkpoint_bytes())
+                        if self.position_index_path: write_file_atomically(self.position_index_path, self.position_index.snapshot_bytes())
+                        self.handoff_socket.close()
+                        os.unlink(self.handoff_path) # The new process binds its own handoff socket here
+                        fds = [self.server_socket.fileno()] + ([self.admin_socket.fileno()] if self.admin_socket else [])
+                        socket.send_fds(handoff_conn, [b"ok"], fds)
+                        self.handed_off = True # From here on the new process owns the state files too
+                except OSError as e:
+                    print(f"Handoff failed: {e}")
+            if self.handed_off:
+                self.wakeup_writer.send(b"x") # Wake the accept loop so it exits
+                break
+
+    def admit_connection(self, ip):
+        # Cheap checks before a new socket gets a seat, a thread or any JSON work
+        with self.admission_lock:
+            if not self.handshake_bucket.consume():
+                self.rejections["handshake_rate"] += 1; return False
+            if self.connections_per_ip[ip] >= self.max_connections_per_ip:
+                self.rejections["connections_per_ip"] += 1; return False
+            return True
+
+    def register_connection(self, ip):
+        with self.admission_lock:
+            self.connections_per_ip[ip] += 1
+            if ip not in self.ip_message_buckets:
+                self.ip_message_buckets[ip] = TokenBucket(self.ip_message_rate, self.ip_message_burst)
+
+    def release_connection(self, ip):
+        if ip is None: return
+        with self.admission_lock:
+            self.connections_per_ip[ip] -= 1
+            if self.connections_per_ip[ip] <= 0:
+                del self.connections_per_ip[ip]
+                self.ip_message_buckets.pop(ip, None)
+
+    def allow_message(self, connection_bucket, ip_bucket):
+        # Runs before JSON parsing; over-budget lines are dropped without touching game_lock
+        if not connection_bucket.consume():
+            with self.admission_lock: self.rejections["message_rate"] += 1
+            return False
+        with self.admission_lock:
+            if ip_bucket is not None and not ip_bucket.consume():
+                self.rejections["ip_message_rate"] += 1
+                return False
+        return True
+
+    def clear_client_data(self):
+        # This function MUST be called with self.game_lock already acquired
+        for client_info in self.client_data.values():
+            for timer in client_info.timers(): self.timers.cancel(timer)
+            self.release_connection(client_info.ip)
+        self.client_data.clear()
 
     def handle_disconnection(self, client_socket):
         # This function MUST be called with self.game_lock already acquired
         # to prevent race conditions on shared lists/dicts.
+        started = self.profiler.start()
+        try:
+            self._handle_disconnection(client_socket)
+        finally:
+            if started: self.profiler.stop("handle_disconnection", started)
 
+    def _handle_disconnection(self, client_socket):
         if client_socket not in self.client_data and client_socket not in self.clients:
             print(f"Disconnection for an already removed or unknown client.")
             return
 
-        disconnected_player_data = self.client_data.pop(client_socket, {})
-        disconnected_player_symbol = disconnected_player_data.get("symbol", "Unknown")
+        disconnected_player_data = self.client_data.pop(client_socket, None)
+        disconnected_player_symbol = disconnected_player_data.symbol if disconnected_player_data else "Unknown"
+        opponent_socket = None
+        if disconnected_player_data:
+            for timer in disconnected_player_data.timers():
+                self.timers.cancel(timer)
+            self.release_connection(disconnected_player_data.ip)
+            opponent_socket = disconnected_player_data.opponent_socket
+            if self.restoring and disconnected_player_data.resume_token: # Give the seat back to the restore pool
+                self.restored_seats[disconnected_player_data.resume_token] = {
+                    "symbol": disconnected_player_symbol, "rematch_requested": disconnected_player_data.rematch_requested}
         
         print(f"Handling disconnection for Player {disconnected_player_symbol}...")
-        print(f"Clients before removal: {[cd.get('symbol') for cd in self.client_data.values()]}")
+        print(f"Clients before removal: {[cd.symbol for cd in self.client_data.values()]}")
 
 
         if client_socket in self.clients:
             self.clients.remove(client_socket)
-        
-        thread_to_remove = self.client_threads.pop(client_socket, None)
-        if thread_to_remove:
-            print(f"Removed thread reference for Player {disconnected_player_symbol}.")
 
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR) # Wakes this client's handler thread if it is blocked in recv
+        except (socket.error, OSError):
+            pass
         try:
             client_socket.close()
             print(f"Socket closed for Player {disconnected_player_symbol}.")
@@ -148,33 +1338,34 @@ class Connect4Server:
             print(f"Error closing socket for {disconnected_player_symbol}, might be already closed.")
             pass
 
-        opponent_socket = disconnected_player_data.get("opponent_socket")
         if opponent_socket and opponent_socket in self.client_data:
-            print(f"Updating opponent ({self.client_data[opponent_socket].get('symbol')}) of {disconnected_player_symbol}'s disconnection.")
-            self.client_data[opponent_socket]["opponent_socket"] = None # Mark opponent as having no paired opponent
+            print(f"Updating opponent ({self.client_data[opponent_socket].symbol}) of {disconnected_player_symbol}'s disconnection.")
+            self.client_data[opponent_socket].opponent_socket = None # Mark opponent as having no paired opponent
 
         # If a game was active OR if players were deciding a rematch
         if self.game_active or (self.game.game_over and len(self.clients) == 1):
             print(f"Game session was active or pending rematch for Player {disconnected_player_symbol}.")
             self.game.game_over = True # Ensure game is marked over
             self.game_active = False  # Session with this pair is no longer fully active
+            self.stop_turn_clock()
 
-            if opponent_socket and opponent_socket in self.clients: # Check if opponent_socket is still valid
+            if opponent_socket and opponent_socket in self.clients and not self.shutting_down: # Check if opponent_socket is still valid
                 self.send_json(opponent_socket, {
                     "type": "opponent_disconnected",
                     "payload": {"message": f"Player {disconnected_player_symbol} has disconnected. Session over."}
                 })
-                print(f"Notified Player {self.client_data.get(opponent_socket, {}).get('symbol')} about {disconnected_player_symbol}'s disconnection.")
+                print(f"Notified Player {self.symbol_of(opponent_socket)} about {disconnected_player_symbol}'s disconnection.")
         
-        print(f"Clients after removal of {disconnected_player_symbol}: {len(self.clients)} left - {[cd.get('symbol') for cd in self.client_data.values()]}")
+        print(f"Clients after removal of {disconnected_player_symbol}: {len(self.clients)} left - {[cd.symbol for cd in self.client_data.values()]}")
 
         # If NO clients are left, this was the end of a session. Reset everything for a new pair.
-        if not self.clients:
+        if not self.clients and not self.restoring:
             print("All clients from the session have disconnected. Performing full server reset for new session.")
             self.game.reset_game(starting_player="X")    # Resets board, turn, game_over=False etc.
+            self.stop_turn_clock(); self.clock.reset()    # No clock runs without players
             self.session_scores = {'X': 0, 'O': 0}       # Reset scores
             self.current_session_starting_player = "X"   # Reset starter for next session
-            self.client_data.clear()                      # Clear all client specific data
+            self.clear_client_data()                      # Clear all client specific data
             self.game_active = False                      # Ensure game is not marked active
             self.current_turn_client = None               # No current turn
             print("Server fully reset and ready for a completely new pair of players.")
@@ -183,50 +1374,128 @@ class Connect4Server:
             # Ensure game_active is false, as a 2-player game cannot continue.
             self.game_active = False
             self.current_turn_client = None # No active turn if only one player
-            remaining_client_symbol = self.client_data.get(self.clients[0], {}).get('symbol')
+            remaining_client_symbol = self.symbol_of(self.clients[0])
             print(f"One client ({remaining_client_symbol}) remains. Game is not active. Waiting for another player.")
             # The remaining client might receive an "opponent_disconnected" message if they were in a game.
             # If they were waiting for a game to start, they continue waiting.
 
-    def handle_client(self, client_socket, player_symbol):
-        # ... (Welcome message - same as before)
-        self.send_json(client_socket, {
-            "type": "welcome",
-            "payload": {"symbol": player_symbol, "message": f"Welcome! You are Player {player_symbol}."}
-        })
+    def open_admin_socket(self, admin_port):
+        # Admin commands are accepted on loopback only and never take a player seat
+        if admin_port is None: return None
+        admin_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        admin_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            admin_socket.bind(('127.0.0.1', admin_port))
+            admin_socket.listen(4)
+            print(f"Admin commands accepted on 127.0.0.1:{admin_port}")
+            return admin_socket
+        except socket.error as e:
+            print(f"Admin port unavailable ({e}); admin commands disabled.")
+            admin_socket.close()
+            return None
+
+    def run_admin_listener(self):
+        while True:
+            try: admin_conn, _address = self.admin_socket.accept()
+            except OSError: break # Admin socket closed on shutdown
+            threading.Thread(target=self.handle_admin, args=(admin_conn,), daemon=True).start()
+
+    def handle_admin(self, admin_conn):
+        # One JSON command per line, e.g. {"command": "profile_stats"}; one JSON reply per line
+        buffer = ""
+        try:
+            while True:
+                chunk = admin_conn.recv(4096).decode('utf-8')
+                if not chunk: break
+                buffer += chunk
+                while '\n' in buffer:
+                    line, buffer = buffer.split('\n', 1)
+                    if not line.strip(): continue
+                    try: reply = self.process_admin_command(json.loads(line))
+                    except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+                        reply = {"ok": False, "error": f"Bad command: {e}"}
+                    admin_conn.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+        except (socket.error, OSError) as e:
+            print(f"Admin connection error: {e}")
+        finally:
+            try: admin_conn.close()
+            except OSError: pass
+
+    def process_admin_command(self, data):
+        command = data.get("command")
+        if command == "profile_on":
+            self.profiler.enabled = True
+            return {"ok": True, "enabled": True}
+        elif command == "profile_off":
+            self.profiler.enabled = False
+            return {"ok": True, "enabled": False}
+        elif command == "profile_reset":
+            self.profiler.reset()
+            return {"ok": True}
+        elif command == "profile_stats":
+            return {"ok": True, "profile": self.profiler.report(int(data.get("top", 10)))}
+        elif command == "profile_capture":
+            seconds = float(data.get("seconds", 10))
+            if not 0 < seconds <= self.MAX_CAPTURE_SECONDS: # Also rejects NaN; an endless capture would never finish
+                return {"ok": False, "error": f"seconds must be more than 0 and at most {self.MAX_CAPTURE_SECONDS:g}."}
+            name = data.get("name") or time.strftime("connect4_profile_%Y%m%d_%H%M%S.txt")
+            if not isinstance(name, str) or not self.PROFILE_NAME.fullmatch(name):
+                return {"ok": False, "error": "name must be a plain file name (letters, digits, '_', '-', '.')."}
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, name)
+            if not self.profiler.start_capture(seconds, path):
+                return {"ok": False, "error": "A capture is already running."}
+            return {"ok": True, "path": path, "seconds": seconds}
+        elif command == "position_stats":
+            with self.game_lock:
+                snapshot = self.position_index.copy()
+            top = [{"hash": f"{key:016x}", "count": count} for count, key in snapshot.most_common(int(data.get("top", 10)))]
+            return {"ok": True, "positions": snapshot.size, "capacity": len(snapshot.keys), "most_common": top}
+        elif command == "admission_stats":
+            with self.admission_lock:
+                return {"ok": True, "rejections": dict(self.rejections), "connections_per_ip": dict(self.connections_per_ip)}
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+    def handle_client(self, client_socket, player_symbol, client_ip=None):
+        with self.game_lock:
+            self.send_welcome(client_socket)
         
+        buffer = ""
+        connection_bucket = TokenBucket(self.message_rate, self.message_burst) # Only this thread uses it
+        with self.admission_lock: ip_bucket = self.ip_message_buckets.get(client_ip)
+        rate_limit_notified = False
         try:
             while client_socket in self.clients: # Main loop for this client's connection
-                # Wait for game to be active or for messages if game already started/ended
-                with self.game_lock:
-                    is_active_now = self.game_active
-                    is_game_over_now = self.game.game_over
-                    is_my_turn_now = (self.current_turn_client == client_socket)
-
-                # If game is active and not over, and it's my turn, prompt is handled by server before this loop iteration
-                # This loop is primarily for receiving messages.
-                
-                buffer = ""
-                # Set a timeout so that the loop can check `client_socket in self.clients` condition periodically
-                client_socket.settimeout(1.0) 
-                try:
-                    chunk = client_socket.recv(1024).decode('utf-8')
-                    if not chunk: raise ConnectionResetError("Client closed connection (recv returned empty)")
-                    buffer += chunk
-                    # Process all full JSON messages in the buffer
-                    while '\n' in buffer:
-                        message_str, buffer = buffer.split('\n', 1)
-                        data = json.loads(message_str)
-                        self.process_client_message(client_socket, player_symbol, data)
-                except socket.timeout:
-                    # Timeout allows the outer `while client_socket in self.clients:` to be re-checked
-                    # Also check if game is over and we should be prompting for rematch implicitly
-                    with self.game_lock:
-                        if self.game.game_over and self.game_active: # Game ended, client needs to know to show rematch
-                            # This state might imply a message was missed or client needs a nudge
-                            pass # Rematch decision is client-initiated by message
-                    continue 
-                client_socket.settimeout(None) # Reset timeout for blocking operations if any were planned
+                # Blocking recv: the thread sleeps until data arrives. Dead or silent peers are
+                # reaped by the timer wheel, which shuts the socket down and wakes this recv.
+                chunk = client_socket.recv(1024).decode('utf-8')
+                if not chunk: raise ConnectionResetError("Client closed connection (recv returned empty)")
+                self.note_client_activity(client_socket)
+                buffer += chunk
+                # Process all full JSON messages in the buffer
+                while '\n' in buffer:
+                    message_str, buffer = buffer.split('\n', 1)
+                    if not self.allow_message(connection_bucket, ip_bucket):
+                        if not rate_limit_notified: # Tell the client once per flood, not once per dropped line
+                            with self.game_lock:
+                                self.send_json(client_socket, {"type": "error", "payload": {"error_code": "RATE_LIMITED", "message": "Too many messages; some were dropped."}})
+                            rate_limit_notified = True
+                        continue
+                    rate_limit_notified = False
+                    started = self.profiler.start()
+                    data = json.loads(message_str)
+                    if started: self.profiler.stop("json_decode", started)
+                    player_symbol = self.symbol_of(client_socket, player_symbol) # May change on seat reclaim
+                    started = self.profiler.start()
+                    self.process_client_message(client_socket, player_symbol, data)
+                    if started:
+                        msg_type = data.get('type')
+                        known = isinstance(msg_type, str) and msg_type in self.CLIENT_MESSAGE_TYPES
+                        self.profiler.stop(f"msg:{msg_type}" if known else "msg:other", started)
+                if len(buffer) > self.max_message_bytes: # No newline in sight; refuse to buffer forever
+                    with self.admission_lock: self.rejections["oversized_message"] += 1
+                    print(f"Player {player_symbol} sent an oversized message. Dropping connection.")
+                    break
 
         except (socket.error, ConnectionResetError, BrokenPipeError, json.JSONDecodeError, KeyError) as e:
             print(f"Error in handle_client for Player {player_symbol}: {e} ({type(e).__name__})")
@@ -244,6 +1513,7 @@ class Connect4Server:
 
         msg_type = data.get("type")
         payload = data.get("payload", {})
+        if self.handed_off: return # A newer process owns the game now; this one is closing
 
         # Acquire lock for operations that change shared state
         # with self.game_lock: # Moved lock to be more granular
@@ -252,32 +1522,32 @@ class Connect4Server:
             with self.game_lock: # Lock only for move and subsequent state changes
                 if self.game_active and not self.game.game_over and self.current_turn_client == client_socket:
                     col = payload.get("column")
-                    if self.game.is_valid_move(col):
+                    time_left = self.clock.time_left(time.monotonic())
+                    if time_left is not None and time_left <= 0: # Arrived after the deadline, before on_flag_fall got the lock
+                        self.flag_fall(self.game.current_player_symbol)
+                    elif self.game.is_valid_move(col):
                         self.game.make_move(col)
+                        self.position_index.add(self.game.board_hash())
                         board_payload = {"board": self.game.get_board_string()}
                         game_over_payload = None
 
                         if self.game.check_winner():
-                            self.game.game_over = True
-                            self.session_scores[self.game.winner] += 1
                             game_over_payload = {"winner": self.game.winner, "message": f"Player {self.game.winner} wins!", "board": self.game.get_board_string()}
                         elif self.game.is_board_full(): # Check after winner
-                            self.game.game_over = True
                             game_over_payload = {"draw": True, "message": "It's a draw!", "board": self.game.get_board_string()}
                         
-                        if self.game.game_over:
-                            # self.game_active remains True until rematch decision or disconnect
-                            self.broadcast_json({"type": "game_over", "payload": game_over_payload})
-                            self.broadcast_json({"type": "score_update", "payload": {"scores": self.session_scores}})
-                            for sock_fd, client_info_val in self.client_data.items(): client_info_val["rematch_requested"] = False # Corrected
-                            print(f"Game over. Winner: {self.game.winner}, Draw: {self.game.is_draw}. Scores: {self.session_scores}")
+                        if game_over_payload:
+                            self.finish_game(game_over_payload)
                         else:
+                            self.stop_turn_clock(completed_move=True)
                             self.game.switch_player()
+                            self.start_turn_clock()
                             board_payload["turn"] = self.game.current_player_symbol
+                            board_payload["clock"] = self.clock_payload()
                             self.broadcast_json({"type": "board_update", "payload": board_payload})
                             self.current_turn_client = self.get_opponent_socket(client_socket)
                             if self.current_turn_client:
-                                 self.send_json(self.current_turn_client, {"type":"your_turn", "payload": {"message": f"Player {self.game.current_player_symbol}'s turn."}})
+                                 self.send_json(self.current_turn_client, {"type":"your_turn", "payload": {"message": f"Player {self.game.current_player_symbol}'s turn.", "clock": board_payload["clock"]}})
                     else: # Invalid move
                         self.send_json(client_socket, {"type": "error", "payload": {"error_code": "INVALID_MOVE", "message": "Invalid move."}})
                 # else: client tried to move out of turn or when game not active/over
@@ -286,15 +1556,15 @@ class Connect4Server:
         elif msg_type == "request_rematch":
             with self.game_lock: # Lock for rematch logic
                 print(f"Player {player_symbol} requested a rematch.")
-                if client_socket in self.client_data: self.client_data[client_socket]["rematch_requested"] = True
+                if client_socket in self.client_data: self.client_data[client_socket].rematch_requested = True
                 
                 opponent_socket = self.get_opponent_socket(client_socket)
                 
                 # Check if both players (who must still be connected) requested rematch
                 can_rematch = False
                 if opponent_socket and opponent_socket in self.client_data:
-                    if self.client_data[client_socket].get("rematch_requested") and \
-                       self.client_data[opponent_socket].get("rematch_requested"):
+                    if self.client_data[client_socket].rematch_requested and \
+                       self.client_data[opponent_socket].rematch_requested:
                         can_rematch = True
                 
                 if can_rematch:
@@ -309,8 +1579,8 @@ class Connect4Server:
                     # A more robust way is to check symbols directly
                     p1_sock = self.clients[0]
                     p2_sock = self.clients[1]
-                    p1_sym = self.client_data[p1_sock]['symbol']
-                    p2_sym = self.client_data[p2_sock]['symbol']
+                    p1_sym = self.client_data[p1_sock].symbol
+                    p2_sym = self.client_data[p2_sock].symbol
 
                     if self.game.current_player_symbol == p1_sym: self.current_turn_client = p1_sock
                     elif self.game.current_player_symbol == p2_sym: self.current_turn_client = p2_sock
@@ -319,23 +1589,59 @@ class Connect4Server:
                         print(f"Warning: Starter symbol {self.game.current_player_symbol} didn't match client symbols {p1_sym}, {p2_sym}")
 
 
-                    for sock_fd, client_info_val in self.client_data.items(): client_info_val["rematch_requested"] = False # Reset requests
+                    for client_info in self.client_data.values(): client_info.rematch_requested = False # Reset requests
+                    self.clock.reset()
+                    self.start_turn_clock()
                     
                     self.broadcast_json({"type": "new_game", "payload": {
                         "board": self.game.get_board_string(),
                         "turn": self.game.current_player_symbol,
                         "message": f"Rematch! Player {self.game.current_player_symbol} starts.",
-                        "scores": self.session_scores
+                        "scores": self.session_scores,
+                        "clock": self.clock_payload()
                     }})
                 elif opponent_socket: # Only one requested so far, or opponent hasn't responded
                     self.send_json(client_socket, {"type": "rematch_info", "payload": {"message": "Rematch requested. Waiting for opponent..."}})
                     # Inform opponent only if they haven't requested yet
-                    if not self.client_data[opponent_socket].get("rematch_requested"):
+                    if not self.client_data[opponent_socket].rematch_requested:
                          self.send_json(opponent_socket, {"type": "rematch_info", "payload": {"message": f"Player {player_symbol} wants a rematch! Click 'Play Again'."}})
                 else: # Opponent disconnected
                      self.send_json(client_socket, {"type":"info", "payload":{"message": "Cannot rematch, opponent has left."}})
                      # This client might then send quit_session or just disconnect
         
+        elif msg_type == "analyze_position":
+            with self.game_lock: # Snapshot only; the search itself runs without holding the lock
+                board = self.game.board # Already a copy
+                to_move = self.game.current_player_symbol
+                finished = self.game.game_over
+                canonical = self.game.canonical_hash()
+                times_reached = self.position_index.count(self.game.board_hash())
+            if finished:
+                with self.game_lock:
+                    self.send_json(client_socket, {"type": "error", "payload": {"error_code": "GAME_FINISHED", "message": "No position to analyze."}})
+                return
+            evaluations, cached = self.analyzer.analyze(board, to_move, canonical)
+            scored = [col for col in range(7) if evaluations[col] is not None]
+            best_column = max(scored, key=lambda col: evaluations[col]) if scored else None
+            with self.game_lock:
+                self.send_json(client_socket, {"type": "position_analysis", "payload": {
+                    "evaluations": evaluations, "best_column": best_column, "to_move": to_move, "cached": cached,
+                    "times_reached": times_reached
+                }})
+
+        elif msg_type == "analysis_stats":
+            with self.game_lock:
+                self.send_json(client_socket, {"type": "analysis_stats", "payload": self.analyzer.cache.stats()})
+
+        elif msg_type == "hello":
+            with self.game_lock:
+                if self.restoring and not self.reclaim_seat(client_socket, payload.get("resume_token")):
+                    self.send_json(client_socket, {"type": "error", "payload": {"error_code": "RESTORING", "message": "Server is restoring an earlier game. Try again shortly."}})
+                    self.handle_disconnection(client_socket)
+
+        elif msg_type == "pong":
+            pass # Liveness only; note_client_activity already recorded it
+
         elif msg_type == "quit_session":
             with self.game_lock: # Lock for quit session
                 print(f"Player {player_symbol} quit the session.")
@@ -353,8 +1659,21 @@ class Connect4Server:
 
 
     def run(self):
+        if self.thread_stack_size:
+            try: threading.stack_size(self.thread_stack_size) # Applies to every thread started from here on
+            except (ValueError, RuntimeError) as e: print(f"Keeping the default thread stack size ({e}).")
+        threading.Thread(target=self.timers.run, daemon=True).start()
+        threading.Thread(target=self.clock_scheduler.run, daemon=True).start()
+        if self.admin_socket:
+            threading.Thread(target=self.run_admin_listener, daemon=True).start()
+        if self.position_index_path:
+            self.timers.schedule(self.index_snapshot_interval, self.on_index_snapshot_due)
+        if self.checkpoint_path:
+            self.timers.schedule(self.checkpoint_interval, self.on_checkpoint_due)
+        if self.handoff_socket:
+            threading.Thread(target=self.run_handoff_listener, daemon=True).start()
         try:
-            while True:
+            while not self.handed_off:
                 ready_to_accept = False
                 with self.game_lock:
                     if len(self.clients) < 2:
@@ -363,11 +1682,12 @@ class Connect4Server:
                         # or we are waiting for the first/second player of a new session.
                         # Full reset for a new session (scores, client_data) happens in handle_disconnection
                         # when len(self.clients) becomes 0.
-                        if len(self.clients) == 0 and (self.game_active or self.game.game_over): # Ensure clean slate if starting fresh
+                        if len(self.clients) == 0 and (self.game_active or self.game.game_over) and not self.restoring: # Ensure clean slate if starting fresh
                             print("Server ensuring clean state before accepting new players.")
                             self.game.reset_game("X")
+                            self.stop_turn_clock(); self.clock.reset()
                             self.session_scores = {'X':0, 'O':0}
-                            self.client_data.clear()
+                            self.clear_client_data()
                             self.current_session_starting_player = "X"
                             self.game_active = False
                             self.current_turn_client = None
@@ -375,15 +1695,24 @@ class Connect4Server:
 
                 if ready_to_accept:
                     print(f"Waiting for players... ({len(self.clients)}/2 connected). Game Active: {self.game_active}, Game Over: {self.game.game_over}")
+                    readable, _, _ = select.select([self.server_socket, self.wakeup_reader], [], [])
+                    if self.wakeup_reader in readable: continue # Handed off; the loop condition ends the loop
                     try:
                         client_sock, address = self.server_socket.accept()
                         print(f"Connection from {address}")
                     except socket.error as e: print(f"Error accepting: {e}"); break
                     except OSError as e: print(f"OSError on accept (server socket likely closed): {e}"); break
 
+                    if not self.admit_connection(address[0]): # Rejected before any work is done for it
+                        print(f"Rejected connection from {address} (admission limits).")
+                        try: client_sock.close()
+                        except: pass
+                        continue
+
 
                     with self.game_lock:
                         if len(self.clients) >= 2: # Re-check after acquiring lock
+                            with self.admission_lock: self.rejections["server_full"] += 1
                             self.send_json(client_sock, {"type": "error", "payload": {"error_code": "SERVER_FULL", "message": "Server is full."}})
                             try: client_sock.close()
                             except: pass
@@ -391,62 +1720,50 @@ class Connect4Server:
 
                         player_symbol = "X" if not self.client_data else "O" # Assign X if no client_data, else O
                         
-                        self.clients.append(client_sock) # Add to generic list first
-                        self.client_data[client_sock] = {
-                            "symbol": player_symbol, "rematch_requested": False, "opponent_socket": None
-                        }
+                        self.clients.add(client_sock) # Add to the connection set first
+                        self.client_data[client_sock] = ConnectionRecord(
+                            player_symbol, ip=address[0], resume_token=None if self.restoring else secrets.token_hex(8))
+                        self.register_connection(address[0])
+                        self.arm_connection_timers(client_sock)
                         
-                        if len(self.clients) == 1: # This is the first player of a pair
+                        if self.restoring:
+                            self.send_json(client_sock, {"type": "info", "payload": {"message": "Server restarted. Reclaiming your seat..."}})
+                        elif len(self.clients) == 1: # This is the first player of a pair
                              self.send_json(client_sock, {"type": "info", "payload": {"message": "Waiting for an opponent..."}})
                         elif len(self.clients) == 2:
-                            p1_sock, p2_sock = self.clients[0], self.clients[1]
-                            self.client_data[p1_sock]["opponent_socket"] = p2_sock
-                            self.client_data[p2_sock]["opponent_socket"] = p1_sock
-                            
-                            # Ensure symbols are distinct if assignment logic had issues
-                            if self.client_data[p1_sock]["symbol"] == self.client_data[p2_sock]["symbol"]:
-                                self.client_data[p2_sock]["symbol"] = "O" if self.client_data[p1_sock]["symbol"] == "X" else "X"
-                            
-                            print(f"Two players connected: {self.client_data[p1_sock]['symbol']} and {self.client_data[p2_sock]['symbol']}. Initializing game...")
-                            
-                            self.game.reset_game(starting_player=self.current_session_starting_player) 
-                            self.game_active = True
-                            
-                            p1_sym = self.client_data[p1_sock]['symbol']
-                            p2_sym = self.client_data[p2_sock]['symbol']
-
-                            if self.game.current_player_symbol == p1_sym: self.current_turn_client = p1_sock
-                            elif self.game.current_player_symbol == p2_sym: self.current_turn_client = p2_sock
-                            else: # Default if mismatch (shouldn't happen with X/O)
-                                self.current_turn_client = p1_sock 
-                                print(f"Warning: Game starter {self.game.current_player_symbol} didn't match P1({p1_sym}) or P2({p2_sym}). Defaulting to P1.")
-
-                            
-                            self.broadcast_json({"type": "game_start", "payload": {
-                                "board": self.game.get_board_string(),
-                                "turn": self.game.current_player_symbol,
-                                "message": f"Game starting! Player {self.game.current_player_symbol}'s turn.",
-                                "scores": self.session_scores 
-                            }})
+                            self.pair_clients()
                         
-                        thread = threading.Thread(target=self.handle_client, args=(client_sock, player_symbol))
+                        thread = threading.Thread(target=self.handle_client, args=(client_sock, player_symbol, address[0]))
                         thread.daemon = True
-                        self.client_threads[client_sock] = thread
                         thread.start()
                 else: 
-                    time.sleep(0.5) # Short sleep if not accepting, to avoid busy-waiting
+                    select.select([self.wakeup_reader], [], [], 0.5) # Short wait if not accepting; a handoff ends it early
         except KeyboardInterrupt: print("\nServer shutting down via Ctrl+C...")
+        except SystemExit: print("\nServer shutting down (terminated)...")
         except Exception as e: print(f"Critical unhandled server error in run loop: {e}")
         finally:
             print("Closing all connections and shutting down server socket...")
+            self.shutting_down = True # Closing sockets below must not end the session for the other player
+            self.save_checkpoint() # No-op after a handoff: the new process already has the state
+            self.timers.stop()
+            self.clock_scheduler.stop()
+            farewell = "Server is restarting..." if self.handed_off else "Server is shutting down."
             for client_sock_final in list(self.clients): # Use a copy
-                try: self.send_json(client_sock_final, {"type": "info", "payload": {"message": "Server is shutting down."}})
+                try: self.send_json(client_sock_final, {"type": "info", "payload": {"message": farewell}})
                 except: pass
                 try: client_sock_final.close()
                 except: pass
             self.server_socket.close()
+            if self.admin_socket: self.admin_socket.close()
+            if self.handoff_socket and not self.handed_off: # After a handoff the path belongs to the new process
+                self.handoff_socket.close()
+                try: os.unlink(self.handoff_path)
+                except OSError: pass
             print("Server socket closed.")
+            self.save_position_index()
 
 if __name__ == "__main__":
+    # `kill` and service managers send SIGTERM; turn it into SystemExit so run() still saves state on the way out
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     server = Connect4Server(port=5555)
     server.run()
\ No newline at end of file